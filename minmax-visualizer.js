@@ -840,7 +840,8 @@ function renderTree() {
 
   if (hoveredNode) {
     const nodePos = positions.get(hoveredNode)
-    if (nodePos) {
+    // Nodes loaded from a Python trace have no board
+    if (nodePos && hoveredNode.boardState.length > 0) {
       const boardType = parseInt(document.getElementById("boardType").value)
       renderNodeBoardPreview(
         nodePos.x + NODE_CONFIG.radius + 10,
@@ -1594,6 +1595,233 @@ async function expandMinMaxTree() {
   }
 }
 
+/**
+
+ * Read the records of a Python search trace, NDJSON or binary
+
+ */
+
+// Binary record: node id, parent id, ply, action, remaining depth, flags,
+// alpha, beta, value (struct "<iiBbbBiii" in min_max_with_alpha_beta.py)
+const TRACE_RECORD_SIZE = 24
+const TRACE_MAXIMIZING = 1
+const TRACE_CUTOFF = 2
+const TRACE_NULL_MOVE = 4
+const TRACE_VERIFICATION = 8
+const TRACE_REDUCED = 16
+
+function parseSearchTrace(buffer) {
+  const bytes = new Uint8Array(buffer)
+
+  if (bytes[0] === "{".charCodeAt(0)) {
+    return new TextDecoder()
+      .decode(bytes)
+      .split("\n")
+      .filter((line) => line.trim())
+      .map((line) => JSON.parse(line))
+  }
+
+  const view = new DataView(buffer)
+  const records = []
+  for (
+    let offset = 0;
+    offset + TRACE_RECORD_SIZE <= buffer.byteLength;
+    offset += TRACE_RECORD_SIZE
+  ) {
+    const flags = view.getUint8(offset + 11)
+    records.push({
+      id: view.getInt32(offset, true),
+      parent: view.getInt32(offset + 4, true),
+      ply: view.getUint8(offset + 8),
+      action: view.getInt8(offset + 9),
+      depth: view.getInt8(offset + 10),
+      alpha: view.getInt32(offset + 12, true),
+      beta: view.getInt32(offset + 16, true),
+      value: view.getInt32(offset + 20, true),
+      isMaximizing: (flags & TRACE_MAXIMIZING) !== 0,
+      cutoff: (flags & TRACE_CUTOFF) !== 0,
+      kind:
+        flags & TRACE_NULL_MOVE
+          ? "null_move"
+          : flags & TRACE_VERIFICATION
+            ? "verification"
+            : flags & TRACE_REDUCED
+              ? "reduced"
+              : "search",
+    })
+  }
+  return records
+}
+
+/**
+
+ * Build the tree data of the visualizer from trace records. The root
+ * actions of the trace become the children of one root node. Nodes of the
+ * searches verifying null move cutoffs repeat the children of their parent
+ * and are left out, and so are the reduced probes of late moves that were
+ * searched again at full depth.
+
+ */
+
+function buildTraceTree(records, rootIsMaximizing) {
+  const rootNode = {
+    id: "trace_root",
+    boardState: [],
+    depth: 0,
+    value: 0,
+    action: -1,
+    isMaximizing: rootIsMaximizing,
+    children: [],
+    isPruned: false,
+  }
+
+  // Records are written when their value is known, children before parents
+  const nodes = new Map()
+  let verificationNodes = 0
+  let reducedNodes = 0
+  // A re-search is a sibling of its reduced probe with the same action
+  const searchedMoves = new Set()
+  for (const record of records) {
+    if (record.kind !== "reduced") {
+      searchedMoves.add(`${record.parent}:${record.action}`)
+    }
+  }
+  for (const record of records) {
+    if (record.kind === "verification") {
+      verificationNodes++
+      continue
+    }
+    if (
+      record.kind === "reduced" &&
+      searchedMoves.has(`${record.parent}:${record.action}`)
+    ) {
+      reducedNodes++
+      continue
+    }
+    nodes.set(record.id, {
+      id: `trace_${record.id}`,
+      boardState: [],
+      depth: record.ply,
+      value: record.value,
+      action: record.action,
+      isMaximizing: record.isMaximizing,
+      children: [],
+      alpha: record.alpha,
+      beta: record.beta,
+      isPruned: false,
+      cutoff: record.cutoff,
+      kind: record.kind,
+    })
+  }
+
+  for (const record of records) {
+    const node = nodes.get(record.id)
+    if (!node) continue
+    const parent = record.parent === -1 ? rootNode : nodes.get(record.parent)
+    if (!parent) continue
+    parent.children.push(node)
+  }
+
+  // Only count the nodes still connected to the root
+  let totalNodes = 0
+  let maxDepthReached = 0
+  const stack = [...rootNode.children]
+  while (stack.length > 0) {
+    const node = stack.pop()
+    totalNodes++
+    maxDepthReached = Math.max(maxDepthReached, node.depth)
+    stack.push(...node.children)
+  }
+
+  // Best line: the best child of every node, values are the tiger's
+  const bestPath = []
+  let currentNode = rootNode
+  while (currentNode.children.length > 0) {
+    let bestChild = currentNode.children[0]
+    for (const child of currentNode.children) {
+      const isBetter = currentNode.isMaximizing
+        ? child.value > bestChild.value
+        : child.value < bestChild.value
+      if (isBetter) {
+        bestChild = child
+      }
+    }
+    if (currentNode === rootNode) {
+      rootNode.value = bestChild.value
+    }
+    bestPath.push(bestChild.id)
+    currentNode = bestChild
+  }
+
+  return {
+    rootNode,
+    bestPath,
+    totalNodes,
+    maxDepthReached,
+    prunedNodes: 0,
+    verificationNodes,
+    reducedNodes,
+    // Python trace nodes maximize for the tiger
+    aiPlayer: 2,
+  }
+}
+
+/**
+
+ * Load a trace written by the Python search (--trace) and show its tree
+
+ */
+
+async function loadSearchTrace(event) {
+  const file = event.target.files[0]
+  if (!file) return
+
+  try {
+    updateStatus(`Loading ${file.name}...`, "info")
+
+    // The AI player setting is the side to move at the root
+    const aiPlayer = parseInt(document.getElementById("aiPlayer").value)
+
+    const records = parseSearchTrace(await file.arrayBuffer())
+
+    treeData = buildTraceTree(records, aiPlayer === 2)
+
+    initializeNodeExpansionStates(treeData.rootNode)
+
+    const bestChild = treeData.rootNode.children.find(
+      (child) => child.id === treeData.bestPath[0]
+    )
+
+    updateTreeStats({
+      totalNodes: treeData.totalNodes,
+
+      maxDepthReached: treeData.maxDepthReached,
+
+      bestMove: bestChild ? bestChild.action : "-",
+
+      bestValue: bestChild ? bestChild.value : "-",
+    })
+
+    centerTree()
+
+    updateStatus(
+      `Trace loaded: ${treeData.totalNodes} nodes, ${treeData.verificationNodes} null move verification nodes and ${treeData.reducedNodes} re-searched reduced nodes left out`,
+
+      "success"
+    )
+  } catch (error) {
+    console.error("Error loading search trace:", error)
+
+    updateStatus(`Error: ${error.message}`, "error")
+    treeData = null
+
+    renderCanvas()
+  } finally {
+    // Allow loading the same file again
+    event.target.value = ""
+  }
+}
+
 // Make functions available globally for HTML event handlers
 
 window.expandMinMaxTree = expandMinMaxTree
@@ -1607,3 +1835,5 @@ window.zoomIn = zoomIn
 window.zoomOut = zoomOut
 
 window.resetZoom = resetZoom
+
+window.loadSearchTrace = loadSearchTrace
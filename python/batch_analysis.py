@@ -0,0 +1,289 @@
+"""
+Batch analysis of positions in a bounded process pool
+
+Positions are read one per line, in the format of Board.to_position_string,
+and streamed to a process pool where each is analysed with analyse_position
+under a depth and/or time limit. Results are appended to a JSON lines file,
+either in input order or as they complete. At most a fixed window of
+positions is in flight or waiting to be written, so memory use does not
+depend on the size of the input.
+
+Progress is checkpointed next to the output file. A killed job started
+again with --resume continues after the last checkpoint: the output is cut
+back to the checkpointed size and the positions written since are analysed
+again.
+
+Usage:
+    python batch_analysis.py positions.txt results.jsonl --depth 4
+    python batch_analysis.py positions.txt results.jsonl --time-limit 0.5 --resume
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import min_max_with_alpha_beta as engine
+from min_max_with_alpha_beta import Board, analyse_position
+
+
+def read_positions(
+    path: str, start: int = 0, done: Optional[Set[int]] = None
+) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (index, position) from a positions file, skipping the positions
+    before start and the ones in done. Blank lines are not counted.
+    """
+    index = 0
+    with open(path) as positions_file:
+        for line in positions_file:
+            position = line.strip()
+            if not position:
+                continue
+            if index >= start and not (done and index in done):
+                yield index, position
+            index += 1
+
+
+def _quiet_worker() -> None:
+    """Pool initializer: the engine prints its progress, which nobody reads here"""
+    sys.stdout = open(os.devnull, "w")
+
+
+def analyse_one(
+    index: int,
+    position: str,
+    depth: Optional[int],
+    time_limit: Optional[float],
+    top_moves: int,
+) -> Dict:
+    """Analyse one position, returns its JSON result"""
+    start_time = time.time()
+    nodes_before = engine.search_stats["nodes"]
+    # Keep the worker memory flat over millions of positions
+    engine.explored_states.clear()
+    try:
+        game_board = Board.from_position_string(position)
+        lines = analyse_position(game_board, top_moves, depth, time_limit)
+    except Exception as error:
+        return {"index": index, "position": position, "error": str(error)}
+
+    return {
+        "index": index,
+        "position": position,
+        "score": lines[0][0] if lines else None,
+        "move": lines[0][1] if lines else None,
+        "lines": [
+            {"score": score, "move": move, "pv": variation}
+            for score, move, variation in lines
+        ],
+        "nodes": engine.search_stats["nodes"] - nodes_before,
+        "seconds": round(time.time() - start_time, 4),
+    }
+
+
+def _analyse_task(task: Tuple) -> Dict:
+    return analyse_one(*task)
+
+
+class Checkpoint:
+    """
+    Progress of a batch job: every position before completed is written,
+    plus the ones in pending, and the output is output_bytes long.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = 0
+        self.pending: Set[int] = set()
+        self.output_bytes = 0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as checkpoint_file:
+            saved = json.load(checkpoint_file)
+        self.completed = saved["completed"]
+        self.pending = set(saved["pending"])
+        self.output_bytes = saved["output_bytes"]
+        return True
+
+    def save(self) -> None:
+        # Write a new file and swap it in, so a kill never leaves half a checkpoint
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump(
+                {
+                    "completed": self.completed,
+                    "pending": sorted(self.pending),
+                    "output_bytes": self.output_bytes,
+                },
+                checkpoint_file,
+            )
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary_path, self.path)
+
+
+def run_batch(
+    positions_path: str,
+    output_path: str,
+    depth: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    top_moves: int = 1,
+    processes: Optional[int] = None,
+    in_input_order: bool = True,
+    resume: bool = False,
+    window: Optional[int] = None,
+    checkpoint_every: int = 1000,
+) -> int:
+    """Analyse every position of a file, returns how many were analysed"""
+    processes = processes or os.cpu_count() or 1
+    window = window or processes * 8
+    checkpoint = Checkpoint(output_path + ".checkpoint")
+
+    if resume and checkpoint.load():
+        print(f"Resuming after {checkpoint.completed} positions")
+        # Extending a short output would fill it with zero bytes
+        actual_bytes = (
+            os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        )
+        output_bytes = min(checkpoint.output_bytes, actual_bytes)
+        if output_bytes < checkpoint.output_bytes:
+            print(
+                f"Warning: {output_path} is shorter than its checkpoint, "
+                "some results are missing"
+            )
+        with open(output_path, "ab") as output_file:
+            output_file.truncate(output_bytes)
+    else:
+        open(output_path, "wb").close()
+        if os.path.exists(checkpoint.path):
+            os.remove(checkpoint.path)
+
+    # A slot is only freed once every earlier position is written, which
+    # bounds both the tasks in flight and the results waiting to be written
+    free_slots = threading.BoundedSemaphore(window)
+    # Lets the pool's task feeding thread stop waiting for a slot on errors
+    stop_feeding = threading.Event()
+
+    def tasks() -> Iterator[Tuple]:
+        for index, position in read_positions(
+            positions_path, checkpoint.completed, checkpoint.pending
+        ):
+            while not free_slots.acquire(timeout=0.5):
+                if stop_feeding.is_set():
+                    return
+            yield index, position, depth, time_limit, top_moves
+
+    # Results by index that are not written yet (input order), or written
+    # but not yet below the completed mark (completion order)
+    waiting: Dict[int, Optional[bytes]] = {}
+    next_index = checkpoint.completed
+    analysed = 0
+    start_time = time.time()
+
+    with open(output_path, "ab") as output_file, mp.Pool(
+        processes, initializer=_quiet_worker
+    ) as pool:
+        try:
+            for result in pool.imap_unordered(_analyse_task, tasks()):
+                analysed += 1
+                line = (json.dumps(result) + "\n").encode()
+                if in_input_order:
+                    waiting[result["index"]] = line
+                else:
+                    output_file.write(line)
+                    waiting[result["index"]] = None
+
+                # Move the completed mark over the finished positions
+                while True:
+                    if next_index in waiting:
+                        waiting_line = waiting.pop(next_index)
+                        if waiting_line is not None:
+                            output_file.write(waiting_line)
+                        free_slots.release()
+                    elif next_index in checkpoint.pending:
+                        # Written before the job was resumed
+                        checkpoint.pending.discard(next_index)
+                    else:
+                        break
+                    next_index += 1
+
+                if analysed % checkpoint_every == 0:
+                    # The results must be on disk before the checkpoint says so
+                    output_file.flush()
+                    os.fsync(output_file.fileno())
+                    checkpoint.completed = next_index
+                    checkpoint.pending |= {
+                        index for index, line in waiting.items() if line is None
+                    }
+                    checkpoint.pending = {
+                        index for index in checkpoint.pending if index >= next_index
+                    }
+                    checkpoint.output_bytes = output_file.tell()
+                    checkpoint.save()
+                    rate = analysed / (time.time() - start_time)
+                    print(f"{analysed} positions analysed ({rate:.1f} per second)")
+        finally:
+            stop_feeding.set()
+
+        pool.close()
+        pool.join()
+
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        checkpoint.completed = next_index
+        checkpoint.pending = set()
+        checkpoint.output_bytes = output_file.tell()
+        checkpoint.save()
+
+    print(f"Done: {analysed} positions in {time.time() - start_time:.2f} seconds")
+    return analysed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a file of positions")
+    parser.add_argument("positions", help="File with one position string per line")
+    parser.add_argument("output", help="JSON lines file for the results")
+    parser.add_argument("--depth", type=int, help="Search depth per position")
+    parser.add_argument(
+        "--time-limit", type=float, help="Seconds per position, deepening iteratively"
+    )
+    parser.add_argument("--top", type=int, default=1, help="Best moves per position")
+    parser.add_argument("--processes", type=int, help="Worker processes")
+    parser.add_argument(
+        "--order",
+        choices=["input", "completion"],
+        default="input",
+        help="Write results in input order or as they complete",
+    )
+    parser.add_argument(
+        "--window", type=int, help="Positions in flight or waiting to be written"
+    )
+    parser.add_argument("--checkpoint-every", type=int, default=1000)
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue after the last checkpoint"
+    )
+    arguments = parser.parse_args()
+
+    run_batch(
+        arguments.positions,
+        arguments.output,
+        depth=arguments.depth,
+        time_limit=arguments.time_limit,
+        top_moves=arguments.top,
+        processes=arguments.processes,
+        in_input_order=arguments.order == "input",
+        resume=arguments.resume,
+        window=arguments.window,
+        checkpoint_every=arguments.checkpoint_every,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of the parallel root search backends
+
+Searches the root moves of a set of positions one after the other in this
+process, in a process pool and in a thread pool, and reports the time, the
+nodes searched per second and the speedup over the serial search. The
+values found by the backends are checked against each other.
+
+The thread pool is benchmarked even when the GIL is enabled, where its
+threads take turns and it can only be as fast as the serial search;
+get_next_best_move uses it on free-threaded builds only.
+
+Usage:
+    python benchmark_backends.py --depth 5
+    python benchmark_backends.py positions.txt --depth 6 --repeat 3
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import min_max_with_alpha_beta as engine
+from min_max_with_alpha_beta import (
+    Board,
+    estimate_search_work,
+    free_threading_enabled,
+    get_possible_actions,
+    search_root_moves,
+)
+
+# Middle game positions, used when no positions file is given
+DEFAULT_POSITIONS = [
+    "00201102001100021010100/1/8/1/-1",
+    "00221102011100001010100/2/8/0/-1",
+    "00201112001100021010100/2/9/1/-1",
+    "20022000001000000000000/2/1/0/-1",
+]
+
+
+def _search_serial(game_board, depth, actions, work, is_maximizing):
+    return search_root_moves(game_board, depth, actions, is_maximizing)[0]
+
+
+BACKENDS: Dict[str, Callable] = {
+    "serial": _search_serial,
+    "process": engine._search_root_moves_in_pool,
+    "thread": engine._search_root_moves_in_threads,
+}
+
+
+def run_backend(
+    name: str, positions: List[str], depth: int
+) -> Tuple[float, int, List[List[int]]]:
+    """Search every position with a backend, returns (seconds, nodes, values)"""
+    search = BACKENDS[name]
+    nodes_before = engine.search_stats["nodes"]
+    values = []
+    seconds = 0.0
+    for position in positions:
+        game_board = Board.from_position_string(position)
+        actions = get_possible_actions(game_board)
+        work = [estimate_search_work(game_board, action, depth) for action in actions]
+        # Every backend starts from empty tables
+        engine.explored_states.clear()
+        engine.clear_search_heuristics()
+
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = search(
+                game_board, depth, actions, work, game_board.current_player == 2
+            )
+        seconds += time.perf_counter() - start_time
+        values.append([value for value, _, _ in results])
+    return seconds, engine.search_stats["nodes"] - nodes_before, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the search backends")
+    parser.add_argument("positions", nargs="?", help="File of position strings")
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per backend")
+    parser.add_argument(
+        "--backends",
+        default="serial,process,thread",
+        help="Comma separated backends to run",
+    )
+    arguments = parser.parse_args()
+
+    if arguments.positions:
+        with open(arguments.positions) as positions_file:
+            positions = [line.strip() for line in positions_file if line.strip()]
+    else:
+        positions = DEFAULT_POSITIONS
+
+    print(f"Python {sys.version.split()[0]}, free-threaded: {free_threading_enabled()}")
+    print(f"{len(positions)} positions at depth {arguments.depth}\n")
+    print(f"{'backend':<10}{'seconds':>10}{'nodes':>12}{'nodes/s':>12}{'speedup':>10}")
+
+    serial_seconds = None
+    reference_values = None
+    for name in arguments.backends.split(","):
+        best_seconds = float("inf")
+        for _ in range(arguments.repeat):
+            seconds, nodes, values = run_backend(name, positions, arguments.depth)
+            best_seconds = min(best_seconds, seconds)
+        if name == "serial":
+            serial_seconds = best_seconds
+        speedup = f"{serial_seconds / best_seconds:.2f}x" if serial_seconds else "-"
+        print(
+            f"{name:<10}{best_seconds:>10.3f}{nodes:>12}"
+            f"{nodes / best_seconds:>12.0f}{speedup:>10}"
+        )
+
+        if reference_values is None:
+            reference_values = values
+        elif values != reference_values:
+            print(f"  {name} found different values than the first backend")
+
+
+if __name__ == "__main__":
+    main()
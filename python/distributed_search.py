@@ -0,0 +1,529 @@
+"""
+Distributed root search over TCP workers
+
+A coordinator splits the search of a position into tasks and hands them to
+worker processes, on this machine or on others, over TCP. A task is a
+position string (Board.to_position_string), the root actions to search from
+it and the depth. The worker searches them with search_root_moves and sends
+back their values and principal variations.
+
+Messages in both directions are JSON objects prefixed with their length as
+a big-endian uint32:
+
+    search:  {"type": "search", "search": 3, "task": 12, "position": "...",
+              "actions": [4, 9], "depth": 5}
+    result:  {"type": "result", "task": 12, "results": [[value, action, pv]],
+              "nodes": 5310, "seconds": 0.8}
+    busy:    {"type": "busy", "task": 12}
+
+A worker runs one search at a time, since the engine's tables are shared,
+and answers tasks from other connections with busy while it searches.
+
+Root actions whose subtree is estimated to be large are split once more:
+every action after them becomes its own task and the coordinator combines
+their values. The coordinator runs one thread per worker and every thread
+takes the next task from a shared queue, so fast workers take more tasks.
+Once the queue is empty, idle workers also take over copies of the tasks
+that have been running the longest, and the first result wins. A task whose
+worker fails or times out goes back to the queue, unless it already has a
+result or another copy of it is still running. Tasks that fail on every
+attempt, or that are left when no worker is reachable, are searched in the
+coordinator.
+
+Positions do not carry the move history, so the workers do not see draws by
+move repetition.
+
+Usage:
+    python distributed_search.py worker --port 7100
+    python distributed_search.py search <position> --workers host1:7100,host2:7100
+    python distributed_search.py local <position> --workers 4 --depth 5
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import min_max_with_alpha_beta as engine
+from min_max_with_alpha_beta import (
+    Board,
+    estimate_search_work,
+    get_possible_actions,
+    get_search_depth,
+    search_root_moves,
+)
+
+MESSAGE_LENGTH = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 16 << 20
+
+
+def send_message(connection: socket.socket, message: Dict) -> None:
+    """Send a length-prefixed JSON message"""
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    connection.sendall(MESSAGE_LENGTH.pack(len(payload)) + payload)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(connection: socket.socket) -> Dict:
+    """Receive a length-prefixed JSON message"""
+    (size,) = MESSAGE_LENGTH.unpack(_receive_exactly(connection, MESSAGE_LENGTH.size))
+    if size > MAX_MESSAGE_SIZE:
+        raise ConnectionError(f"Message of {size} bytes is too large")
+    return json.loads(_receive_exactly(connection, size))
+
+
+def search_task(message: Dict) -> Dict:
+    """Search the actions of a task message, returns the result message"""
+    game_board = Board.from_position_string(message["position"])
+    results, seconds, stats = search_root_moves(
+        game_board,
+        message["depth"],
+        message["actions"],
+        game_board.current_player == 2,
+    )
+    return {
+        "type": "result",
+        "task": message["task"],
+        "results": [list(result) for result in results],
+        "nodes": stats["nodes"],
+        "seconds": round(seconds, 4),
+    }
+
+
+class _WorkerServer(socketserver.ThreadingTCPServer):
+    # A restarted worker can take its port back at once
+    allow_reuse_address = True
+    daemon_threads = True
+    search_id: Optional[int] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Held while a search runs, every connection shares the engine's tables
+        self.search_lock = threading.Lock()
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    """Serve the tasks of one coordinator connection"""
+
+    def handle(self) -> None:
+        while True:
+            try:
+                message = receive_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            if message.get("type") != "search":
+                continue
+            if not self.server.search_lock.acquire(blocking=False):
+                send_message(self.request, {"type": "busy", "task": message["task"]})
+                continue
+            try:
+                # Tables are kept between the tasks of one search only
+                if message["search"] != self.server.search_id:
+                    self.server.search_id = message["search"]
+                    engine.explored_states.clear()
+                    engine.clear_search_heuristics()
+                reply = search_task(message)
+            except Exception as error:
+                reply = {"type": "error", "task": message["task"], "error": str(error)}
+            finally:
+                self.server.search_lock.release()
+            send_message(self.request, reply)
+
+
+def serve(host: str = "0.0.0.0", port: int = 7100, ready=None) -> None:
+    """
+    Run a worker until it is killed. ready, if given, is a connection that
+    is sent the bound port once the worker accepts connections.
+    """
+    # Searches are run one at a time, any pool would compete with other workers
+    engine.search_dispatch = "serial"
+    with _WorkerServer((host, port), _WorkerHandler) as server:
+        if ready is not None:
+            ready.send(server.server_address[1])
+            ready.close()
+        server.serve_forever()
+
+
+def _serve_quietly(host: str, port: int, ready) -> None:
+    sys.stdout = open(os.devnull, "w")
+    serve(host, port, ready)
+
+
+def spawn_local_workers(
+    count: int, host: str = "127.0.0.1"
+) -> Tuple[List[mp.Process], List[Tuple[str, int]]]:
+    """Start workers on free localhost ports, returns (processes, addresses)"""
+    processes = []
+    addresses = []
+    for _ in range(count):
+        receiver, sender = mp.Pipe(duplex=False)
+        process = mp.Process(target=_serve_quietly, args=(host, 0, sender), daemon=True)
+        process.start()
+        sender.close()
+        addresses.append((host, receiver.recv()))
+        receiver.close()
+        processes.append(process)
+    return processes, addresses
+
+
+def stop_local_workers(processes: List[mp.Process]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Parse "host:port" """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class _Task:
+    """Actions searched from one position, with where their result goes"""
+
+    def __init__(
+        self,
+        task_id: int,
+        position: str,
+        actions: List[int],
+        depth: int,
+        root_action: int,
+    ):
+        self.task_id = task_id
+        self.position = position
+        self.actions = actions
+        self.depth = depth
+        # Root action whose subtree was split into this task, -1 if not split
+        self.root_action = root_action
+        # Failed searches of the task, and the copies of it running now
+        self.attempts = 0
+        self.running = 0
+        self.given_up = False
+        self.started = 0.0
+        self.results: Optional[List[Tuple[int, int, List[int]]]] = None
+
+
+class DistributedSearch:
+    """Coordinator of the root searches run by a set of TCP workers"""
+
+    def __init__(
+        self,
+        workers: List[Tuple[str, int]],
+        task_timeout: float = 300.0,
+        max_attempts: int = 3,
+        connect_timeout: float = 5.0,
+        split_work: Optional[int] = 20000,
+        batch_work: int = 500,
+    ):
+        self.workers = workers
+        self.task_timeout = task_timeout
+        self.max_attempts = max_attempts
+        self.connect_timeout = connect_timeout
+        # Root actions estimated above split_work are searched action by action
+        # below them, the ones under batch_work are packed into shared tasks
+        self.split_work = split_work
+        self.batch_work = batch_work
+        self.search_id = 0
+        self.stats = {"tasks": 0, "failures": 0, "copies": 0, "local": 0, "nodes": 0}
+
+    def _make_tasks(
+        self, game_board: Board, depth: int, actions: List[int]
+    ) -> List[_Task]:
+        position = game_board.to_position_string()
+        tasks: List[_Task] = []
+        batch: List[int] = []
+        batch_work = 0
+        for action in actions:
+            work = estimate_search_work(game_board, action, depth)
+            child_board = game_board.clone()
+            if (
+                self.split_work is not None
+                and work > self.split_work
+                and depth > 1
+                and child_board.perform_next_move(action)
+                and not child_board.game_over
+                and get_possible_actions(child_board)
+            ):
+                child_position = child_board.to_position_string()
+                for child_action in get_possible_actions(child_board):
+                    tasks.append(
+                        _Task(
+                            len(tasks),
+                            child_position,
+                            [child_action],
+                            depth - 1,
+                            action,
+                        )
+                    )
+                continue
+
+            batch.append(action)
+            batch_work += work
+            if batch_work >= self.batch_work:
+                tasks.append(_Task(len(tasks), position, batch, depth, -1))
+                batch, batch_work = [], 0
+        if batch:
+            tasks.append(_Task(len(tasks), position, batch, depth, -1))
+        return tasks
+
+    def search(
+        self,
+        game_board: Board,
+        depth: Optional[int] = None,
+        actions: Optional[List[int]] = None,
+    ) -> List[Tuple[int, int, List[int]]]:
+        """Search the root actions of a position, returns their (value, action, pv)"""
+        depth = depth or get_search_depth(game_board)
+        actions = actions if actions is not None else get_possible_actions(game_board)
+        self.search_id += 1
+        tasks = self._make_tasks(game_board, depth, actions)
+        self.stats["tasks"] += len(tasks)
+
+        pending: "queue.Queue[_Task]" = queue.Queue()
+        for task in tasks:
+            pending.put(task)
+        running: Dict[int, _Task] = {}
+        lock = threading.Lock()
+        all_done = threading.Event()
+        if not tasks:
+            all_done.set()
+
+        def check_done() -> None:
+            # Called with the lock held
+            if all(task.results is not None or task.given_up for task in tasks):
+                all_done.set()
+
+        def finish(task: _Task, results: List) -> None:
+            with lock:
+                task.running -= 1
+                if task.results is not None:
+                    return  # A copy of the task finished first
+                task.results = [(value, action, pv) for value, action, pv in results]
+                running.pop(task.task_id, None)
+                check_done()
+
+        def next_task() -> Optional[_Task]:
+            while not all_done.is_set():
+                try:
+                    task = pending.get(timeout=0.1)
+                except queue.Empty:
+                    # Nothing queued: help with the task running the longest
+                    with lock:
+                        candidates = [
+                            task
+                            for task in running.values()
+                            if task.results is None
+                            and time.monotonic() - task.started > 1.0
+                        ]
+                        if candidates:
+                            task = min(candidates, key=lambda task: task.started)
+                            task.started = time.monotonic()
+                            task.running += 1
+                            self.stats["copies"] += 1
+                            return task
+                    continue
+                with lock:
+                    if task.results is not None or task.given_up:
+                        continue
+                    task.running += 1
+                    task.started = time.monotonic()
+                    running[task.task_id] = task
+                return task
+            return None
+
+        def run_worker(address: Tuple[str, int]) -> None:
+            connection: Optional[socket.socket] = None
+            failures = 0
+            while not all_done.is_set() and failures < self.max_attempts:
+                if connection is None:
+                    try:
+                        connection = socket.create_connection(
+                            address, timeout=self.connect_timeout
+                        )
+                        connection.settimeout(self.task_timeout)
+                    except OSError:
+                        failures += 1
+                        time.sleep(0.5)
+                        continue
+
+                task = next_task()
+                if task is None:
+                    break
+                busy = False
+                try:
+                    send_message(
+                        connection,
+                        {
+                            "type": "search",
+                            "search": self.search_id,
+                            "task": task.task_id,
+                            "position": task.position,
+                            "actions": task.actions,
+                            "depth": task.depth,
+                        },
+                    )
+                    reply = receive_message(connection)
+                    busy = reply.get("type") == "busy"
+                    if reply.get("type") != "result":
+                        raise RuntimeError(reply.get("error", "Invalid reply"))
+                except (OSError, ConnectionError, RuntimeError, ValueError):
+                    with lock:
+                        task.running -= 1
+                        # A busy worker never tried the task
+                        if not busy:
+                            self.stats["failures"] += 1
+                            task.attempts += 1
+                        # Dropped when a result or another copy will do instead
+                        retry = task.results is None and task.running == 0
+                        if retry:
+                            running.pop(task.task_id, None)
+                        if retry and task.attempts >= self.max_attempts:
+                            # Given up on remotely, searched below
+                            task.given_up = True
+                            retry = False
+                            check_done()
+                    if retry:
+                        pending.put(task)
+                    failures += 1
+                    if busy:
+                        # Still connected, try again once its search is done
+                        time.sleep(0.5)
+                        continue
+                    connection.close()
+                    connection = None
+                    continue
+
+                failures = 0
+                with lock:
+                    self.stats["nodes"] += reply["nodes"]
+                finish(task, reply["results"])
+
+            if connection is not None:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=run_worker, args=(address,), daemon=True)
+            for address in self.workers
+        ]
+        for thread in threads:
+            thread.start()
+        while not all_done.is_set() and any(thread.is_alive() for thread in threads):
+            all_done.wait(0.1)
+        # Searches still running on workers are left to finish on their own
+        all_done.set()
+
+        # Whatever the workers could not do is searched here
+        for task in tasks:
+            if task.results is None:
+                self.stats["local"] += 1
+                task_board = Board.from_position_string(task.position)
+                task.results, _, _ = search_root_moves(
+                    task_board,
+                    task.depth,
+                    task.actions,
+                    task_board.current_player == 2,
+                )
+
+        return self._combine(game_board, actions, tasks)
+
+    def _combine(
+        self, game_board: Board, actions: List[int], tasks: List[_Task]
+    ) -> List[Tuple[int, int, List[int]]]:
+        """Put the task results back in the order of the root actions"""
+        values: Dict[int, Tuple[int, int, List[int]]] = {}
+        split_results: Dict[int, List[Tuple[int, int, List[int]]]] = {}
+        for task in tasks:
+            if task.root_action == -1:
+                for result in task.results:  # type: ignore
+                    values[result[1]] = result
+            else:
+                split_results.setdefault(task.root_action, []).extend(
+                    task.results  # type: ignore
+                )
+
+        for root_action, results in split_results.items():
+            child_board = game_board.clone()
+            child_board.perform_next_move(root_action)
+            # The value of the root action is the best one for the side to move
+            choose = max if child_board.current_player == 2 else min
+            value, _, variation = choose(results, key=lambda result: result[0])
+            values[root_action] = (value, root_action, [root_action] + variation)
+
+        return [values[action] for action in actions if action in values]
+
+    def get_best_move(
+        self, game_board: Board, depth: Optional[int] = None
+    ) -> Tuple[int, int, List[int]]:
+        """Find the best move for the side to move, like get_next_best_move"""
+        results = self.search(game_board, depth)
+        if not results:
+            return (-999999, 0, [])
+        if game_board.current_player == 2:
+            return max(results, key=lambda result: result[0])
+        return min(results, key=lambda result: result[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed root search")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Run a search worker")
+    worker_parser.add_argument("--host", default="0.0.0.0")
+    worker_parser.add_argument("--port", type=int, default=7100)
+    for command, workers_help in (
+        ("search", "Comma separated host:port of the workers"),
+        ("local", "Number of workers to start on this machine"),
+    ):
+        search_parser = subparsers.add_parser(
+            command, help=f"Search a position ({command} workers)"
+        )
+        search_parser.add_argument("position", help="Board.to_position_string")
+        search_parser.add_argument("--workers", required=True, help=workers_help)
+        search_parser.add_argument("--depth", type=int)
+        search_parser.add_argument(
+            "--task-timeout", type=float, default=300.0, help="Seconds per task"
+        )
+    arguments = parser.parse_args()
+
+    if arguments.command == "worker":
+        serve(arguments.host, arguments.port)
+        return
+
+    processes: List[mp.Process] = []
+    if arguments.command == "local":
+        processes, workers = spawn_local_workers(int(arguments.workers))
+    else:
+        workers = [parse_address(address) for address in arguments.workers.split(",")]
+
+    try:
+        coordinator = DistributedSearch(workers, task_timeout=arguments.task_timeout)
+        start_time = time.time()
+        game_board = Board.from_position_string(arguments.position)
+        best_move = coordinator.get_best_move(game_board, arguments.depth)
+        print(f"Time taken: {time.time() - start_time:.2f} seconds")
+        print(f"Search stats: {coordinator.stats}")
+        print(f"Best Move: position {best_move[1]} with score {best_move[0]}")
+        print(f"Principal variation: {best_move[2]}")
+    finally:
+        stop_local_workers(processes)
+
+
+if __name__ == "__main__":
+    main()
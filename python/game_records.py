@@ -0,0 +1,398 @@
+"""
+Compact append-only storage for recorded Tigers and Goats games
+
+A record file starts with a fixed file header followed by the games, each
+stored as a fixed-size game header and its actions (Board.perform_action
+indexes, piece selections included) packed as varints:
+
+    file header:  magic "TGREC" + version (16 bytes)
+    game header:  packed moves size (uint32), move count (uint16),
+                  result (uint8), goats captured (uint8)
+    game moves:   move count LEB128 varints
+
+Next to the records file an index file (<path>.idx) holds the byte offset of
+every game as a little-endian uint64. Both files are only ever appended to,
+and a game's moves are synced to disk before its index entry is written.
+If the index is missing or behind, for example after a crash between the
+two writes, the writer rebuilds it from the game headers when it opens the
+file, and cuts off a partly written last game so new games follow the
+complete ones. The reader never writes: it finds the games missing from
+the index in memory.
+
+The reader memory-maps both files, so iterating and filtering an archive
+only touches the game headers and the moves of the games that are used.
+
+Usage:
+    python game_records.py stats games.tgr
+    python game_records.py show games.tgr 12
+    python game_records.py export-positions games.tgr positions.txt
+"""
+
+import argparse
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional
+
+from min_max_with_alpha_beta import Board
+
+FILE_HEADER = struct.Struct("<6sH8x")
+FILE_MAGIC = b"TGREC\x00"
+FILE_VERSION = 1
+GAME_HEADER = struct.Struct("<IHBB")
+OFFSET = struct.Struct("<Q")
+
+# Game results, the same values as Board.winner
+RESULT_DRAW = 0
+RESULT_GOAT_WIN = 1
+RESULT_TIGER_WIN = 2
+RESULT_UNFINISHED = 255
+
+
+class GameRecord(NamedTuple):
+    result: int
+    goats_captured: int
+    moves: List[int]
+
+
+def encode_moves(moves: List[int]) -> bytes:
+    """Pack actions as LEB128 varints"""
+    packed = bytearray()
+    for move in moves:
+        while move >= 0x80:
+            packed.append((move & 0x7F) | 0x80)
+            move >>= 7
+        packed.append(move)
+    return bytes(packed)
+
+
+def decode_moves(packed: bytes, count: int) -> List[int]:
+    """Unpack count LEB128 varint actions"""
+    moves: List[int] = []
+    value = 0
+    shift = 0
+    for byte in packed:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        moves.append(value)
+        value = 0
+        shift = 0
+    if len(moves) != count:
+        raise ValueError(f"Expected {count} moves, decoded {len(moves)}")
+    return moves
+
+
+def get_board_result(game_board: Board) -> int:
+    """Get the record result of a board"""
+    if not game_board.game_over:
+        return RESULT_UNFINISHED
+    return game_board.winner
+
+
+class GameRecordWriter:
+    """Streaming writer appending games to a record file and its index"""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # Bring the index up to date with the games already in the file
+            _truncate_torn_game(path)
+
+        self.records_file = open(path, "ab")
+        self.index_file = open(path + ".idx", "ab")
+        if self.records_file.tell() == 0:
+            self.records_file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+
+    def write_game(self, moves: List[int], result: int, goats_captured: int) -> int:
+        """Append a game, returns its number in the file"""
+        packed_moves = encode_moves(moves)
+        offset = self.records_file.tell()
+        self.records_file.write(
+            GAME_HEADER.pack(len(packed_moves), len(moves), result, goats_captured)
+        )
+        self.records_file.write(packed_moves)
+        # The index entry must never reach the disk before the game it points to
+        self.records_file.flush()
+        os.fsync(self.records_file.fileno())
+        self.index_file.write(OFFSET.pack(offset))
+        return self.index_file.tell() // OFFSET.size - 1
+
+    def write_board(self, game_board: Board) -> int:
+        """Append the game played on a board, returns its number in the file"""
+        return self.write_game(
+            game_board.moves_performed,
+            get_board_result(game_board),
+            game_board.goats_captured_count,
+        )
+
+    def flush(self) -> None:
+        # The records go out first so the index never points past them
+        self.records_file.flush()
+        self.index_file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.records_file.close()
+        self.index_file.close()
+
+    def __enter__(self) -> "GameRecordWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _read_index_size(path: str) -> int:
+    """Size in bytes of the index file of a record file"""
+    index_path = path + ".idx"
+    return os.path.getsize(index_path) if os.path.exists(index_path) else 0
+
+
+def _game_end(records_file: BinaryIO, offset: int, file_size: int) -> Optional[int]:
+    """Get the offset right after the game at offset, None if it is incomplete"""
+    if offset + GAME_HEADER.size > file_size:
+        return None
+    records_file.seek(offset)
+    packed_size = GAME_HEADER.unpack(records_file.read(GAME_HEADER.size))[0]
+    end = offset + GAME_HEADER.size + packed_size
+    return end if end <= file_size else None
+
+
+def _scan_offsets(records_file: BinaryIO, last_offset: Optional[int]) -> List[int]:
+    """
+    Get the offsets of the complete games after the one at last_offset, or
+    of every game when it is None, from the game headers
+    """
+    file_size = os.fstat(records_file.fileno()).st_size
+    offset = FILE_HEADER.size
+    if last_offset is not None:
+        offset = _game_end(records_file, last_offset, file_size) or file_size
+
+    offsets = []
+    while True:
+        end = _game_end(records_file, offset, file_size)
+        if end is None:
+            break  # No more games, or the last one was only partly written
+        offsets.append(offset)
+        offset = end
+    return offsets
+
+
+def rebuild_index(path: str) -> int:
+    """Append the offsets of any games missing from the index, returns the game count"""
+    index_path = path + ".idx"
+    index_size = _read_index_size(path)
+    index_size -= index_size % OFFSET.size  # Drop a torn last entry
+
+    with open(path, "rb") as records_file, open(index_path, "ab+") as index_file:
+        index_file.truncate(index_size)
+        last_offset = None
+        if index_size:
+            index_file.seek(index_size - OFFSET.size)
+            (last_offset,) = OFFSET.unpack(index_file.read(OFFSET.size))
+        for offset in _scan_offsets(records_file, last_offset):
+            index_file.write(OFFSET.pack(offset))
+
+        index_file.seek(0, os.SEEK_END)
+        return index_file.tell() // OFFSET.size
+
+
+def _truncate_torn_game(path: str) -> None:
+    """
+    Cut a partly written last game off a record file and its index, then
+    index the complete games the index is behind on
+    """
+    index_path = path + ".idx"
+    index_size = _read_index_size(path)
+    index_size -= index_size % OFFSET.size
+
+    with open(path, "rb+") as records_file, open(index_path, "ab+") as index_file:
+        file_size = os.fstat(records_file.fileno()).st_size
+        if file_size < FILE_HEADER.size:
+            # Not even the file header was written, start the file over
+            records_file.truncate(0)
+            index_file.truncate(0)
+            return
+
+        # Drop the index entries of games whose moves never reached the disk
+        while index_size:
+            index_file.seek(index_size - OFFSET.size)
+            (last_offset,) = OFFSET.unpack(index_file.read(OFFSET.size))
+            if _game_end(records_file, last_offset, file_size) is not None:
+                break
+            index_size -= OFFSET.size
+        index_file.truncate(index_size)
+
+    game_count = rebuild_index(path)
+
+    with open(path, "rb+") as records_file, open(index_path, "rb") as index_file:
+        file_size = os.fstat(records_file.fileno()).st_size
+        complete_size = FILE_HEADER.size
+        if game_count:
+            index_file.seek((game_count - 1) * OFFSET.size)
+            (last_offset,) = OFFSET.unpack(index_file.read(OFFSET.size))
+            complete_size = _game_end(records_file, last_offset, file_size)
+        records_file.truncate(complete_size)
+
+
+class GameRecordReader:
+    """Memory-mapped reader of a record file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as records_file:
+            magic, version = FILE_HEADER.unpack(records_file.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{path} is not a version {FILE_VERSION} game record file")
+
+        self.records_file = open(path, "rb")
+        self.records = mmap.mmap(self.records_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Only the whole entries of the index, a writer may be adding one
+        index_size = _read_index_size(path)
+        index_size -= index_size % OFFSET.size
+        self.indexed_count = index_size // OFFSET.size
+        self.index_file: Optional[BinaryIO] = None
+        self.index: Optional[mmap.mmap] = None
+        last_offset = None
+        if index_size:
+            self.index_file = open(path + ".idx", "rb")
+            self.index = mmap.mmap(
+                self.index_file.fileno(), index_size, access=mmap.ACCESS_READ
+            )
+            last_offset = self._offset(self.indexed_count - 1)
+        # Games the index is behind on are found without writing it
+        self.unindexed_offsets = _scan_offsets(self.records_file, last_offset)
+        self.game_count = self.indexed_count + len(self.unindexed_offsets)
+
+    def __len__(self) -> int:
+        return self.game_count
+
+    def _offset(self, game_number: int) -> int:
+        if game_number >= self.indexed_count:
+            return self.unindexed_offsets[game_number - self.indexed_count]
+        return OFFSET.unpack_from(self.index, game_number * OFFSET.size)[0]  # type: ignore
+
+    def read_header(self, game_number: int) -> tuple:
+        """Read (packed size, move count, result, goats captured) of a game"""
+        return GAME_HEADER.unpack_from(self.records, self._offset(game_number))
+
+    def __getitem__(self, game_number: int) -> GameRecord:
+        if not 0 <= game_number < self.game_count:
+            raise IndexError(game_number)
+        offset = self._offset(game_number)
+        packed_size, move_count, result, goats_captured = GAME_HEADER.unpack_from(
+            self.records, offset
+        )
+        start = offset + GAME_HEADER.size
+        moves = decode_moves(self.records[start : start + packed_size], move_count)
+        return GameRecord(result, goats_captured, moves)
+
+    def iter_games(
+        self,
+        result: Optional[int] = None,
+        min_moves: int = 0,
+        max_moves: Optional[int] = None,
+    ) -> Iterator[tuple]:
+        """
+        Iterate over (game number, GameRecord) of the games matching the filters.
+        Games are filtered on their headers, only matching games are decoded.
+        """
+        for game_number in range(self.game_count):
+            _, move_count, game_result, _ = self.read_header(game_number)
+            if result is not None and game_result != result:
+                continue
+            if move_count < min_moves or (
+                max_moves is not None and move_count > max_moves
+            ):
+                continue
+            yield game_number, self[game_number]
+
+    def __iter__(self) -> Iterator[GameRecord]:
+        for _, record in self.iter_games():
+            yield record
+
+    def replay(self, game_number: int, upto_move: Optional[int] = None) -> Board:
+        """Replay a game, or its first upto_move actions, on a new board"""
+        game_board = Board()
+        for move in self[game_number].moves[:upto_move]:
+            game_board.perform_action(move)
+        return game_board
+
+    def close(self) -> None:
+        self.records.close()
+        if self.index is not None:
+            self.index.close()
+        self.records_file.close()
+        if self.index_file is not None:
+            self.index_file.close()
+
+    def __enter__(self) -> "GameRecordReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def export_positions(path: str, output_path: str) -> int:
+    """Write every position of the finished games as tune_evaluation.py records"""
+    from tune_evaluation import format_position_record
+
+    exported = 0
+    with GameRecordReader(path) as reader, open(output_path, "wb") as output:
+        for _, record in reader.iter_games():
+            if record.result == RESULT_UNFINISHED:
+                continue
+            game_board = Board()
+            for move in record.moves:
+                game_board.perform_action(move)
+                # Only positions between complete moves
+                if game_board.selected_index_to_move == -1:
+                    output.write(format_position_record(game_board, record.result))
+                    exported += 1
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect game record files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="Count the games by result")
+    stats_parser.add_argument("path")
+    show_parser = subparsers.add_parser("show", help="Replay and display a game")
+    show_parser.add_argument("path")
+    show_parser.add_argument("game_number", type=int)
+    export_parser = subparsers.add_parser(
+        "export-positions", help="Write positions for tune_evaluation.py"
+    )
+    export_parser.add_argument("path")
+    export_parser.add_argument("output")
+    arguments = parser.parse_args()
+
+    if arguments.command == "stats":
+        results = {RESULT_DRAW: 0, RESULT_GOAT_WIN: 0, RESULT_TIGER_WIN: 0}
+        results[RESULT_UNFINISHED] = 0
+        total_moves = 0
+        with GameRecordReader(arguments.path) as reader:
+            for game_number in range(len(reader)):
+                _, move_count, result, _ = reader.read_header(game_number)
+                results[result] = results.get(result, 0) + 1
+                total_moves += move_count
+            print(f"Games: {len(reader)}")
+            print(f"Tiger wins: {results[RESULT_TIGER_WIN]}")
+            print(f"Goat wins: {results[RESULT_GOAT_WIN]}")
+            print(f"Draws: {results[RESULT_DRAW]}")
+            print(f"Unfinished: {results[RESULT_UNFINISHED]}")
+            if len(reader):
+                print(f"Average actions per game: {total_moves / len(reader):.1f}")
+    elif arguments.command == "show":
+        with GameRecordReader(arguments.path) as reader:
+            reader.replay(arguments.game_number).display()
+    else:
+        exported = export_positions(arguments.path, arguments.output)
+        print(f"Exported {exported} positions to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Memory and allocation profile of the search
+
+Plays engine-vs-engine games and measures every get_next_best_move call:
+the peak RSS of the process, the source lines holding the memory that is
+still allocated after the move (tracemalloc), the bytes allocated per node
+searched and the sizes of the caches that live across moves. The root move
+batches that pool workers search are measured the same way in each worker.
+
+tracemalloc only sees the memory that is alive, so bytes per node is the
+peak of the traced memory during a search above what was traced before it,
+divided by the nodes searched, and retained bytes per node is what was
+still traced afterwards. Thread pool batches share the profiled process and
+are counted in its moves. Tracing makes the search several times slower.
+
+With thresholds the run is a regression check: every value over its
+threshold is reported and the exit status is 1.
+
+Usage:
+    python memory_profile.py --games 2 --max-moves 40
+    python memory_profile.py --dispatch parallel --report memory.jsonl
+    python memory_profile.py --max-bytes-per-node 400 --max-rss-growth-mb 50
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import min_max_with_alpha_beta as engine
+from min_max_with_alpha_beta import Board, get_possible_actions
+from tournament import random_openings
+
+MEGABYTE = 1024 * 1024
+
+# Allocations made by the profiling itself
+IGNORED_FILES = [
+    __file__,
+    tracemalloc.__file__,
+    "<frozen importlib._bootstrap>",
+    "<unknown>",
+]
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, None where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def cache_sizes(game_board: Board) -> Dict[str, int]:
+    """Entries in the tables that are kept from one move to the next"""
+    return {
+        "explored_states": len(engine.explored_states),
+        "threat_masks": len(engine._threat_masks),
+        "persistent_cache": (
+            len(engine.persistent_cache) if engine.persistent_cache is not None else 0
+        ),
+        "moves_performed": len(game_board.moves_performed),
+    }
+
+
+def top_allocations(
+    before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, limit: int
+) -> List[Dict]:
+    """The source lines whose allocated memory changed the most"""
+    return [
+        {
+            "line": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_diff": stat.size_diff,
+            "count_diff": stat.count_diff,
+            "size": stat.size,
+        }
+        for stat in after.compare_to(before, "lineno")[:limit]
+    ]
+
+
+class MemoryProfiler:
+    """
+    Measures the moves of the process that creates it, and the batches that
+    its pool workers search. The workers append their records to a file that
+    is read back after each move.
+    """
+
+    def __init__(self, top_lines: int = 5, frames: int = 1):
+        self.top_lines = top_lines
+        self.frames = frames
+        self.pid = os.getpid()
+        self.move_number = 0
+        self.records: List[Dict] = []
+        worker_file, self.worker_path = tempfile.mkstemp(
+            prefix="memory_profile_", suffix=".jsonl"
+        )
+        os.close(worker_file)
+        self.worker_offset = 0
+        self.batch_start: Optional[Tuple] = None
+
+    def __getstate__(self) -> Dict:
+        # Sent to spawned pool workers, which only write their own records
+        state = dict(self.__dict__)
+        state["records"] = []
+        state["batch_start"] = None
+        return state
+
+    def _snapshot(self) -> Optional[tracemalloc.Snapshot]:
+        if not self.top_lines:
+            return None
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, path) for path in IGNORED_FILES]
+        )
+
+    def _start(self) -> Tuple:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        snapshot = self._snapshot()
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        return snapshot, traced, time.perf_counter()
+
+    def _finish(self, start: Tuple, nodes: int) -> Dict:
+        snapshot, traced_before, start_time = start
+        seconds = time.perf_counter() - start_time
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        record = {
+            "pid": os.getpid(),
+            "move": self.move_number,
+            "seconds": round(seconds, 4),
+            "nodes": nodes,
+            "peak_rss": peak_rss_bytes(),
+            "rss": current_rss_bytes(),
+            "traced": traced,
+            "traced_peak": traced_peak,
+            "bytes_per_node": (
+                round((traced_peak - traced_before) / nodes, 1) if nodes else None
+            ),
+            "retained_bytes_per_node": (
+                round((traced - traced_before) / nodes, 1) if nodes else None
+            ),
+        }
+        if snapshot is not None:
+            record["top_lines"] = top_allocations(
+                snapshot, self._snapshot(), self.top_lines
+            )
+        return record
+
+    def profile_move(self, game_board: Board) -> Tuple[int, int, List[int]]:
+        """Find the next move with get_next_best_move, recording its memory use"""
+        self.move_number += 1
+        player = "tiger" if game_board.current_player == 2 else "goat"
+        nodes_before = engine.search_stats["nodes"]
+        start = self._start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            best_move = engine.get_next_best_move(game_board)
+        # The nodes that the workers searched are added to the parent's counts
+        record = self._finish(start, engine.search_stats["nodes"] - nodes_before)
+        record.update(
+            kind="move",
+            player=player,
+            caches=cache_sizes(game_board),
+            workers=self._read_worker_records(),
+        )
+        self.records.append(record)
+        return best_move
+
+    def start_batch(self) -> None:
+        """Called by search_root_moves before it searches a batch"""
+        # The batches of this process are part of its moves
+        if os.getpid() != self.pid:
+            self.batch_start = self._start()
+
+    def end_batch(self, game_board: Board, actions: List[int], nodes: int) -> None:
+        """Called by search_root_moves with the batch it searched"""
+        if self.batch_start is None:
+            return
+        record = self._finish(self.batch_start, nodes)
+        self.batch_start = None
+        record.update(kind="batch", actions=actions, caches=cache_sizes(game_board))
+        # One write per record, so the lines of the workers do not interleave
+        worker_file = os.open(self.worker_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(worker_file, (json.dumps(record) + "\n").encode())
+        finally:
+            os.close(worker_file)
+
+    def _read_worker_records(self) -> List[Dict]:
+        with open(self.worker_path) as worker_file:
+            worker_file.seek(self.worker_offset)
+            lines = worker_file.readlines()
+            self.worker_offset = worker_file.tell()
+        return [json.loads(line) for line in lines]
+
+    def close(self) -> None:
+        if os.path.exists(self.worker_path):
+            os.remove(self.worker_path)
+
+
+class Thresholds(NamedTuple):
+    """Limits of a regression check, None for no limit"""
+
+    peak_rss_mb: Optional[float] = None
+    # Growth of the peak RSS of the profiled process from its first move
+    rss_growth_mb: Optional[float] = None
+    bytes_per_node: Optional[float] = None
+    retained_bytes_per_node: Optional[float] = None
+    explored_states: Optional[int] = None
+
+
+def check_thresholds(records: List[Dict], thresholds: Thresholds) -> List[str]:
+    """Describe every value of the moves and worker batches over its threshold"""
+    failures = []
+    limits = [
+        ("peak_rss", thresholds.peak_rss_mb, MEGABYTE, "MB peak RSS"),
+        ("bytes_per_node", thresholds.bytes_per_node, 1, "bytes per node"),
+        (
+            "retained_bytes_per_node",
+            thresholds.retained_bytes_per_node,
+            1,
+            "retained bytes per node",
+        ),
+    ]
+    for move in records:
+        for record in [move] + move["workers"]:
+            source = f"move {record['move']}"
+            if record["kind"] == "batch":
+                source += f" worker {record['pid']}"
+            for name, limit, unit, description in limits:
+                value = record[name]
+                if limit is not None and value is not None and value / unit > limit:
+                    failures.append(
+                        f"{source}: {value / unit:.1f} {description}"
+                        f" (threshold {limit})"
+                    )
+            explored_states = record["caches"]["explored_states"]
+            if (
+                thresholds.explored_states is not None
+                and explored_states > thresholds.explored_states
+            ):
+                failures.append(
+                    f"{source}: {explored_states} explored states"
+                    f" (threshold {thresholds.explored_states})"
+                )
+
+    if thresholds.rss_growth_mb is not None and records:
+        growth = (records[-1]["peak_rss"] - records[0]["peak_rss"]) / MEGABYTE
+        if growth > thresholds.rss_growth_mb:
+            failures.append(
+                f"peak RSS grew {growth:.1f} MB over {len(records)} moves"
+                f" (threshold {thresholds.rss_growth_mb})"
+            )
+    return failures
+
+
+def play_profiled_game(
+    profiler: MemoryProfiler, opening: List[int], max_moves: int
+) -> None:
+    """Play a game from an opening with every engine move profiled"""
+    game_board = Board()
+    for action in opening:
+        game_board.perform_action(action)
+
+    for _ in range(max_moves):
+        if game_board.game_over:
+            break
+        best_move = profiler.profile_move(game_board)
+        if game_board.perform_next_move(best_move[1]):
+            continue
+        # Like start_game, fall back to the first action that is valid
+        for action in get_possible_actions(game_board):
+            if game_board.perform_next_move(action):
+                break
+        else:
+            game_board.declare_winner(3 - game_board.current_player)
+
+
+def print_record(record: Dict, indent: str = "") -> None:
+    bytes_per_node = record["bytes_per_node"]
+    label = (
+        f"move {record['move']:<4}{record['player']:<6}"
+        if record["kind"] == "move"
+        else f"worker {record['pid']:<8}"
+    )
+    print(
+        f"{indent}{label}{record['nodes']:>9}"
+        f"{record['peak_rss'] / MEGABYTE:>10.1f}"
+        f"{record['traced_peak'] / MEGABYTE:>10.1f}"
+        f"{bytes_per_node if bytes_per_node is not None else '-':>10}"
+        f"{record['caches']['explored_states']:>10}"
+        f"{record['caches']['moves_performed']:>7}"
+    )
+    for line in record.get("top_lines", []):
+        print(f"{indent}    {line['size_diff']:>+12} B  {line['line']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the memory of the search")
+    parser.add_argument("--games", type=int, default=1)
+    parser.add_argument("--max-moves", type=int, default=60, help="Moves per game")
+    parser.add_argument(
+        "--opening-moves", type=int, default=2, help="Random moves before the engine"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, help="Fixed search depth")
+    parser.add_argument(
+        "--dispatch",
+        choices=["auto", "serial", "parallel"],
+        default="auto",
+        help="How get_next_best_move runs the root moves",
+    )
+    parser.add_argument(
+        "--top", type=int, default=3, help="Source lines per move, 0 for none"
+    )
+    parser.add_argument(
+        "--frames", type=int, default=1, help="Frames tracemalloc keeps"
+    )
+    parser.add_argument("--cache", help="Persistent position cache to load")
+    parser.add_argument("--report", help="JSON lines file for the full records")
+    parser.add_argument("--max-peak-rss-mb", type=float)
+    parser.add_argument("--max-rss-growth-mb", type=float)
+    parser.add_argument("--max-bytes-per-node", type=float)
+    parser.add_argument("--max-retained-bytes-per-node", type=float)
+    parser.add_argument("--max-explored-states", type=int)
+    arguments = parser.parse_args()
+
+    engine.search_dispatch = arguments.dispatch
+    engine.search_depth_override = arguments.depth
+    if arguments.cache:
+        engine.load_persistent_cache(arguments.cache)
+
+    profiler = MemoryProfiler(arguments.top, arguments.frames)
+    engine.search_profiler = profiler
+    print(
+        f"{'':<15}{'nodes':>9}{'peak MB':>10}{'traced MB':>10}"
+        f"{'B/node':>10}{'states':>10}{'moves':>7}"
+    )
+    try:
+        openings = random_openings(
+            arguments.games, arguments.opening_moves, arguments.seed
+        )
+        for opening in openings:
+            first_record = len(profiler.records)
+            play_profiled_game(profiler, opening, arguments.max_moves)
+            for record in profiler.records[first_record:]:
+                print_record(record)
+                for worker_record in record["workers"]:
+                    print_record(worker_record, "  ")
+    finally:
+        engine.search_profiler = None
+        profiler.close()
+
+    if arguments.report:
+        with open(arguments.report, "w") as report_file:
+            for record in profiler.records:
+                report_file.write(json.dumps(record) + "\n")
+
+    failures = check_thresholds(
+        profiler.records,
+        Thresholds(
+            peak_rss_mb=arguments.max_peak_rss_mb,
+            rss_growth_mb=arguments.max_rss_growth_mb,
+            bytes_per_node=arguments.max_bytes_per_node,
+            retained_bytes_per_node=arguments.max_retained_bytes_per_node,
+            explored_states=arguments.max_explored_states,
+        ),
+    )
+    for failure in failures:
+        print(f"Over threshold: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"{len(profiler.records)} moves profiled, no threshold exceeded")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,43 @@
 Python code for min max algorithm with alpha-beta pruning for Tigers and Goats game
 """
 
-import copy
+import argparse
+import atexit
+import json
 import traceback
 import os
+import random
+import struct
+import sys
+import threading
 import time
 import multiprocessing as mp
-from typing import List, Literal, Set, Tuple, Dict
+from multiprocessing.util import Finalize
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Literal, Optional, Set, Tuple, Dict
+
+# Weights of the evaluation features in Board.get_value, from the tiger's
+# perspective. A tuned set can be loaded with load_evaluation_weights().
+evaluation_weights: Dict[str, int] = {
+    "blocked_tigers": -10,
+    "goats_captured": 6,
+    "capturable_goats": 3,
+    "all_goats_captured": 100,
+    "all_tigers_blocked": -100,
+}
+
+
+def load_evaluation_weights(path: str) -> Dict[str, int]:
+    """Load evaluation weights from a JSON file, e.g. one written by tune_evaluation.py"""
+    with open(path) as weights_file:
+        loaded_weights = json.load(weights_file)
+
+    unknown_features = set(loaded_weights) - set(evaluation_weights)
+    if unknown_features:
+        raise ValueError(f"Unknown evaluation features: {sorted(unknown_features)}")
+
+    evaluation_weights.update({name: int(w) for name, w in loaded_weights.items()})
+    return evaluation_weights
 
 
 class Board:
@@ -115,6 +146,58 @@ class Board:
             [17, 21],  # 22
         ]
 
+    def clone(self) -> "Board":
+        """
+        Copy the game state for searching. Much cheaper than copy.deepcopy as
+        the connectivity tables never change and are shared with the copy.
+        """
+        cloned = Board.__new__(Board)
+        cloned.__dict__.update(self.__dict__)
+        cloned.board = self.board[:]
+        cloned.possible_movable_destinations = self.possible_movable_destinations[:]
+        cloned.possible_movable_pieces = self.possible_movable_pieces[:]
+        cloned.moves_performed = self.moves_performed[:]
+        cloned.move_pairs = self.move_pairs[:]
+        cloned.position_history = self.position_history.copy()
+        cloned.capture_moves = self.capture_moves.copy()
+        return cloned
+
+    def to_position_string(self) -> str:
+        """
+        Encode the game state as
+        "<23 cell digits>/<player>/<goats placed>/<goats captured>/<selected index>"
+        The move history is not part of the position.
+        """
+        board_digits = "".join(map(str, self.board))
+        return (
+            f"{board_digits}/{self.current_player}/{self.goats_placed_count}"
+            f"/{self.goats_captured_count}/{self.selected_index_to_move}"
+        )
+
+    @staticmethod
+    def from_position_string(position: str) -> "Board":
+        """Create a board from a string written by to_position_string"""
+        fields = position.strip().split("/")
+        if len(fields) != 5 or len(fields[0]) != 23 or not fields[0].isdigit():
+            raise ValueError(f"Invalid position string: {position!r}")
+
+        game_board = Board()
+        game_board.board = [int(cell) for cell in fields[0]]
+        if any(cell > 2 for cell in game_board.board):
+            raise ValueError(f"Invalid position string: {position!r}")
+        game_board.current_player = int(fields[1])
+        game_board.goats_placed_count = int(fields[2])
+        game_board.goats_captured_count = int(fields[3])
+        game_board.update_possible_movable_pieces()
+
+        # Selecting the piece again sets up its destinations
+        selected_index = int(fields[4])
+        if selected_index != -1:
+            if not game_board.perform_action(selected_index):
+                raise ValueError(f"Invalid selected index in position: {position!r}")
+            game_board.moves_performed = []
+        return game_board
+
     def get_all_empty_locations(self) -> List[int]:
         empty_list: List[int] = []
         for i, ele in enumerate(self.board):
@@ -552,22 +635,16 @@ class Board:
         all_goats_captured = self.goats_captured_count == self.total_goats_to_place
 
         # Using the heuristic design from option 3 (threshold/non-linear bonuses)
-        if player == 2:  # Tiger's perspective
-            score = (
-                (-10 * blocked_tigers)
-                + (6 * goats_captured)
-                + (3 * capturable_goats)
-                + (100 * (1 if all_goats_captured else 0))
-                - (100 * (1 if blocked_tigers == 3 else 0))
-            )
-        else:  # Goat's perspective
-            score = (
-                (10 * blocked_tigers)
-                - (6 * goats_captured)
-                - (3 * capturable_goats)
-                - (100 * (1 if all_goats_captured else 0))
-                + (100 * (1 if blocked_tigers == 3 else 0))
-            )
+        weights = evaluation_weights
+        score = (
+            (weights["blocked_tigers"] * blocked_tigers)
+            + (weights["goats_captured"] * goats_captured)
+            + (weights["capturable_goats"] * capturable_goats)
+            + (weights["all_goats_captured"] * (1 if all_goats_captured else 0))
+            + (weights["all_tigers_blocked"] * (1 if blocked_tigers == 3 else 0))
+        )
+        if player != 2:  # Goat's perspective
+            score = -score
 
         if print_heuristics:
             print(f"""
@@ -693,8 +770,8 @@ def show_menu() -> Tuple[bool, bool]:
             print("Invalid input. Please enter a number.")
 
 
-def start_game():
-    """Start and run the game"""
+def start_game(record_path: Optional[str] = None):
+    """Start and run the game, appending it to a game record file if one is given"""
     print(f"Tigers and Goats Game - {time.strftime('%Y-%m-%d %H:%M:%S')}")
 
     # Show menu and get player selections
@@ -737,9 +814,11 @@ def start_game():
             "selectToPlace"
             if game_board.current_player == 1
             and game_board.goats_placed_count < game_board.total_goats_to_place
-            else "selectToMove"
-            if game_board.selected_index_to_move == -1
-            else "selectDestination"
+            else (
+                "selectToMove"
+                if game_board.selected_index_to_move == -1
+                else "selectDestination"
+            )
         )
         current_player = "Goat" if game_board.current_player == 1 else "Tiger"
         is_current_player_human = (
@@ -838,26 +917,59 @@ def start_game():
         if not success:
             print("Move failed. Try again.")
 
+    if record_path:
+        from game_records import GameRecordWriter
 
-def get_next_best_move(game_board: Board) -> Tuple[int, int, List[int]]:
-    """Use min-max with alpha-beta pruning to find the best move for the AI"""
-    # Determine valid actions based on the current game state
+        with GameRecordWriter(record_path) as writer:
+            game_number = writer.write_board(game_board)
+        print(f"Game saved as game {game_number} in {record_path}")
+
+
+def get_possible_actions(game_board: Board) -> List[int]:
+    """Get the indexes the current player can act on in the current state"""
     if (
         game_board.current_player == 1
         and game_board.goats_placed_count < game_board.total_goats_to_place
     ):
-        # During goat placement phase, place on any empty cell
-        next_action_possible_positions = game_board.get_all_empty_locations()
-        depth = 2  # Use lower depth during placement phase
+        # Goat placement phase
+        return game_board.get_all_empty_locations()
     elif game_board.selected_index_to_move == -1:
-        # If no piece is selected, get all movable pieces
-        next_action_possible_positions = game_board.possible_movable_pieces
-        depth = 3  # Default depth
+        # Selection phase - get all movable pieces
+        return game_board.possible_movable_pieces
+    else:
+        # Destination selection phase
+        return game_board.possible_movable_destinations
+
+
+# Fixed search depth of get_next_best_move, None to pick it by the state
+search_depth_override: Optional[int] = None
+
+
+def get_search_depth(game_board: Board) -> int:
+    """Get the default search depth for the current state"""
+    if search_depth_override is not None:
+        return search_depth_override
+
+    if (
+        game_board.current_player == 1
+        and game_board.goats_placed_count < game_board.total_goats_to_place
+    ):
+        depth = 2  # Use lower depth during placement phase
     else:
-        # If a piece is selected, get all possible destinations
-        next_action_possible_positions = game_board.possible_movable_destinations
         depth = 3  # Default depth
 
+    # Increase depth for endgame situations
+    if game_board.goats_captured_count >= 3 or game_board.count_blocked_tigers() >= 2:
+        depth = 4
+
+    return depth
+
+
+def get_next_best_move(game_board: Board) -> Tuple[int, int, List[int]]:
+    """Use min-max with alpha-beta pruning to find the best move for the AI"""
+    # Determine valid actions based on the current game state
+    next_action_possible_positions = get_possible_actions(game_board)
+
     # Ensure we have valid positions
     if not next_action_possible_positions:
         print("No valid moves found for AI")
@@ -873,41 +985,65 @@ def get_next_best_move(game_board: Board) -> Tuple[int, int, List[int]]:
         # Return a default value if no valid moves are found
         return (-999999, 0, [])
 
-    # Increase depth for endgame situations
-    if game_board.goats_captured_count >= 3 or game_board.count_blocked_tigers() >= 2:
-        depth = 4
+    # A proven win needs no heuristic search
+    if use_proof_solver and (
+        game_board.count_blocked_tigers() >= 2
+        or game_board.goats_captured_count >= game_board.total_goats_to_place - 2
+    ):
+        forced_win = find_forced_win(game_board)
+        if forced_win is not None:
+            print(f"Best Move: position {forced_win[1]} is a proven win")
+            return forced_win
+
+    depth = get_search_depth(game_board)
 
     # For each next action get the min max value and store it and choose the best one.
     min_max_values: List[Tuple[int, int, List[int]]] = []
 
     start_time = time.time()
-    with mp.Pool() as pool:
-        results = []
-        # Determine if we should maximize or minimize based on current player
-        is_maximizing = game_board.current_player == 2  # Maximize for tiger
-
-        args: List[Tuple[Board, int, int, bool, int, int, bool]] = [
-            (
-                copy.deepcopy(game_board),
-                depth,
-                next_action,
-                is_maximizing,  # Maximize for Tiger, minimize for Goat
-                -9999999999,
-                9999999999,
-                True,
-            )  # type: ignore
-            for next_action in next_action_possible_positions
-        ]
-
-        results = pool.starmap(min_max_with_alpha_beta_pruning, args)
-        # Wait until all the processes are finished.
-        pool.close()
-        pool.join()
-
-        min_max_values = results
+    clear_search_heuristics()
+    stats = search_state.stats
+    stats_before = dict(stats)
+    # Determine if we should maximize or minimize based on current player
+    is_maximizing = game_board.current_player == 2  # Maximize for tiger
+
+    work = [
+        estimate_search_work(game_board, next_action, depth)
+        for next_action in next_action_possible_positions
+    ]
+    estimated_seconds = sum(work) * seconds_per_work_unit
+    backend = get_search_backend()
+    # The thread pool is started once and kept
+    startup_seconds = pool_startup_seconds if backend == "process" else 0.0
+
+    if search_dispatch == "serial" or (
+        search_dispatch == "auto"
+        and (
+            len(next_action_possible_positions) <= 2
+            or depth <= 2
+            or estimated_seconds < startup_seconds + INLINE_SEARCH_SECONDS
+        )
+    ):
+        # Small searches finish before a pool would have started
+        min_max_values, _, _ = search_root_moves(
+            game_board, depth, next_action_possible_positions, is_maximizing
+        )
+        _update_work_estimate(time.time() - start_time, sum(work))
+    elif backend == "thread":
+        min_max_values = _search_root_moves_in_threads(
+            game_board, depth, next_action_possible_positions, work, is_maximizing
+        )
+    else:
+        min_max_values = _search_root_moves_in_pool(
+            game_board, depth, next_action_possible_positions, work, is_maximizing
+        )
 
     end_time = time.time()
     print(f"Time taken: {end_time - start_time:.2f} seconds")
+    print(
+        "Search stats: ",
+        {name: stats[name] - stats_before[name] for name in stats},
+    )
     print("Min Max Values: ", min_max_values)
 
     if not min_max_values:
@@ -927,7 +1063,1123 @@ def get_next_best_move(game_board: Board) -> Tuple[int, int, List[int]]:
     return best_move
 
 
-explored_states: Dict[str, int] = {}
+# How get_next_best_move runs the root moves: "auto" searches small trees in
+# this process and large ones in a process pool, "serial" and "parallel"
+# always do one or the other
+search_dispatch: Literal["auto", "serial", "parallel"] = "auto"
+
+# Estimated searches shorter than this (plus the pool start) run inline
+INLINE_SEARCH_SECONDS = 0.2
+# Root moves estimated below this are batched into one pool task
+MIN_TASK_SECONDS = 0.05
+
+# Both are refined from the measured searches
+seconds_per_work_unit = 5e-5
+pool_startup_seconds = 0.1
+
+
+def estimate_search_work(game_board: Board, action: int, depth: int) -> int:
+    """
+    Estimate the size of the tree below a root action from the branching
+    factors of the current state and of the state after the action
+    """
+    branching_factor = max(len(get_possible_actions(game_board)), 1)
+    child_board = game_board.clone()
+    if not child_board.perform_next_move(action):
+        return 1
+    child_branching_factor = max(len(get_possible_actions(child_board)), 1)
+    # Alpha-beta visits about b^(d/2) nodes with perfect move ordering and
+    # b^(3d/4) with random ordering (Knuth and Moore, Pearl). Ordering is far
+    # from perfect below the root, so the estimate uses the 3/4 exponent.
+    return int(child_branching_factor * branching_factor ** ((depth - 1) * 0.75)) + 1
+
+
+def _update_work_estimate(seconds: float, work: int) -> None:
+    """Blend a measured search time into the seconds per work unit estimate"""
+    global seconds_per_work_unit
+    if work > 0 and seconds > 0:
+        seconds_per_work_unit = 0.7 * seconds_per_work_unit + 0.3 * (seconds / work)
+
+
+def search_root_moves(
+    game_board: Board, depth: int, actions: List[int], is_maximizing: bool
+) -> Tuple[List[Tuple[int, int, List[int]]], float, Dict[str, int]]:
+    """
+    Search a batch of root actions one after the other.
+    Returns (results, seconds, search_stats counts of this batch)
+    """
+    if search_profiler is not None:
+        search_profiler.start_batch()
+    start_time = time.time()
+    # The counters of the thread running the batch
+    thread_stats = search_state.stats
+    stats_before = dict(thread_stats)
+    results = [
+        min_max_with_alpha_beta_pruning(
+            game_board.clone(),
+            depth,
+            action,
+            is_maximizing,  # Maximize for Tiger, minimize for Goat
+            -9999999999,
+            9999999999,
+            True,
+        )
+        for action in actions
+    ]
+    if search_tracer is not None:
+        # Pool workers exit without flushing their files
+        search_tracer.flush()
+    stats = {name: thread_stats[name] - stats_before[name] for name in thread_stats}
+    if search_profiler is not None:
+        search_profiler.end_batch(game_board, actions, stats["nodes"])
+    return results, time.time() - start_time, stats
+
+
+def _batch_root_moves(actions: List[int], work: List[int]) -> List[List[int]]:
+    """
+    Group the root actions (by index) into tasks. Each large subtree is its
+    own task, the small ones are packed together so no task is mostly overhead.
+    """
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_seconds = 0.0
+    # Largest first, so the long tasks start before the short ones
+    for i in sorted(range(len(actions)), key=lambda i: work[i], reverse=True):
+        task_seconds = work[i] * seconds_per_work_unit
+        if task_seconds >= MIN_TASK_SECONDS:
+            batches.append([i])
+            continue
+        batch.append(i)
+        batch_seconds += task_seconds
+        if batch_seconds >= MIN_TASK_SECONDS:
+            batches.append(batch)
+            batch, batch_seconds = [], 0.0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _merge_batch_results(
+    batches: List[List[int]],
+    batch_results: List[Tuple[List[Tuple[int, int, List[int]]], float, Dict]],
+    work: List[int],
+) -> List[Tuple[int, int, List[int]]]:
+    """Put the results of the tasks back in the order of the root actions"""
+    results: List[Tuple[int, int, List[int]]] = [None] * len(work)  # type: ignore
+    for batch, (batch_values, seconds, stats) in zip(batches, batch_results):
+        for i, value in zip(batch, batch_values):
+            results[i] = value
+        _update_work_estimate(seconds, sum(work[i] for i in batch))
+        for name, count in stats.items():
+            search_state.stats[name] += count
+    return results
+
+
+def _search_root_moves_in_pool(
+    game_board: Board,
+    depth: int,
+    actions: List[int],
+    work: List[int],
+    is_maximizing: bool,
+) -> List[Tuple[int, int, List[int]]]:
+    """Search the root actions in a process pool"""
+    global pool_startup_seconds
+
+    batches = _batch_root_moves(actions, work)
+
+    if search_tracer is not None:
+        # Forked workers would otherwise inherit the unwritten part of the buffer
+        search_tracer.flush()
+
+    start_time = time.time()
+    with mp.Pool(
+        min(len(batches), os.cpu_count() or 1),
+        initializer=_init_search_worker,
+        initargs=(
+            search_tracer,
+            search_profiler,
+            os.getpid(),
+            persistent_cache_path,
+            evaluation_weights,
+            search_features,
+            search_depth_override,
+        ),
+    ) as pool:
+        args = [
+            (game_board, depth, [actions[i] for i in batch], is_maximizing)
+            for batch in batches
+        ]
+        batch_results = pool.starmap(search_root_moves, args)
+        # Wait until all the processes are finished.
+        pool.close()
+        pool.join()
+    wall_seconds = time.time() - start_time
+
+    results = _merge_batch_results(batches, batch_results, work)
+
+    # Whatever the workers did not spend searching went into starting the pool
+    slowest_batch = max(seconds for _, seconds, _ in batch_results)
+    pool_startup_seconds = 0.7 * pool_startup_seconds + 0.3 * max(
+        wall_seconds - slowest_batch, 0.0
+    )
+    return results
+
+
+# Where get_next_best_move runs parallel searches: "process" in a process
+# pool, "thread" in a thread pool sharing this process's transposition table
+# and history scores. Threads only search side by side on free-threaded
+# builds, so "thread" falls back to processes when the GIL is enabled and
+# "auto" picks threads only when it is not.
+search_backend: Literal["auto", "process", "thread"] = "auto"
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_warned_thread_backend = False
+
+
+def free_threading_enabled() -> bool:
+    """Whether this interpreter runs Python threads without the GIL"""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def get_search_backend() -> Literal["process", "thread"]:
+    """Get the backend the parallel searches use in this interpreter"""
+    global _warned_thread_backend
+
+    if search_backend == "process":
+        return "process"
+    if not free_threading_enabled():
+        if search_backend == "thread" and not _warned_thread_backend:
+            print("The GIL is enabled, searching in a process pool instead of threads")
+            _warned_thread_backend = True
+        return "process"
+    if search_tracer is not None:
+        # The tracer follows one search at a time
+        return "process"
+    return "thread"
+
+
+def _search_batch_in_thread(
+    game_board: Board, depth: int, actions: List[int], is_maximizing: bool
+) -> Tuple[List[Tuple[int, int, List[int]]], float, Dict[str, int]]:
+    """Search a batch in a pool thread, whose killer moves are from old searches"""
+    for killers in search_state.killer_moves:
+        killers[0] = killers[1] = -1
+    return search_root_moves(game_board, depth, actions, is_maximizing)
+
+
+def _search_root_moves_in_threads(
+    game_board: Board,
+    depth: int,
+    actions: List[int],
+    work: List[int],
+    is_maximizing: bool,
+) -> List[Tuple[int, int, List[int]]]:
+    """
+    Search the root actions in a thread pool. Nothing is pickled: the threads
+    read the board and share the tables of this process.
+    """
+    global _thread_pool
+
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            os.cpu_count() or 1, thread_name_prefix="search"
+        )
+    batches = _batch_root_moves(actions, work)
+    futures = [
+        _thread_pool.submit(
+            _search_batch_in_thread,
+            game_board,
+            depth,
+            [actions[i] for i in batch],
+            is_maximizing,
+        )
+        for batch in batches
+    ]
+    batch_results = [future.result() for future in futures]
+    return _merge_batch_results(batches, batch_results, work)
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the analysis time budget is exhausted"""
+
+
+def analyse_position(
+    game_board: Board,
+    k: int = 3,
+    depth: Optional[int] = None,
+    time_limit: Optional[float] = None,
+) -> List[Tuple[int, int, List[int]]]:
+    """
+    Find the k best moves for the current player in a single multi-PV search.
+    Returns up to k (score, move, principal variation) tuples, best first.
+
+    With a fixed depth the position is searched once at that depth. With a
+    time limit the search deepens iteratively and the result of the deepest
+    fully completed iteration is returned; the first iteration is always
+    completed, so there is a move even when the limit is too short. Only the first k moves get a full
+    window; every later move is searched against the k-th best score so far
+    and only re-enters the list if it beats it, so the scores of the returned
+    moves are exact while the rest are cut off as cheaply as a normal search.
+    """
+    global search_deadline
+
+    next_action_possible_positions = list(get_possible_actions(game_board))
+    if not next_action_possible_positions or k < 1:
+        return []
+
+    is_maximizing = game_board.current_player == 2  # Maximize for tiger
+    if depth is None:
+        depth = get_search_depth(game_board) if time_limit is None else 64
+
+    # Without a time budget go straight to the requested depth
+    first_depth = 1 if time_limit is not None else depth
+    deadline = time.monotonic() + time_limit if time_limit is not None else 0.0
+
+    best_lines: List[Tuple[int, int, List[int]]] = []
+    try:
+        for current_depth in range(first_depth, depth + 1):
+            # The first iteration runs to the end, so a line is always returned
+            search_deadline = deadline if best_lines else 0.0
+            try:
+                best_lines = _search_top_k_moves(
+                    game_board,
+                    next_action_possible_positions,
+                    current_depth,
+                    k,
+                    is_maximizing,
+                )
+            except SearchTimeout:
+                break
+
+            # Search the most promising moves first in the next iteration
+            searched = [line[1] for line in best_lines]
+            next_action_possible_positions = searched + [
+                action
+                for action in next_action_possible_positions
+                if action not in searched
+            ]
+    finally:
+        search_deadline = 0.0
+
+    return best_lines
+
+
+def _search_top_k_moves(
+    game_board: Board,
+    root_actions: List[int],
+    depth: int,
+    k: int,
+    is_maximizing: bool,
+) -> List[Tuple[int, int, List[int]]]:
+    """Search all root actions at a fixed depth and keep the k best lines"""
+    best_lines: List[Tuple[int, int, List[int]]] = []
+
+    for action in root_actions:
+        alpha, beta = -9999999999, 9999999999
+        if len(best_lines) == k:
+            # Only a score better than the current k-th best line matters
+            if is_maximizing:
+                alpha = best_lines[-1][0]
+            else:
+                beta = best_lines[-1][0]
+
+        value, _, principal_variation = min_max_with_alpha_beta_pruning(
+            game_board.clone(),
+            depth,
+            action,
+            is_maximizing,
+            alpha,
+            beta,
+            True,
+        )
+        if value <= alpha or value >= beta:
+            # Failed against the k-th best bound, so not one of the k best moves
+            continue
+
+        best_lines.append((value, action, principal_variation))
+        best_lines.sort(key=lambda x: x[0], reverse=is_maximizing)
+        del best_lines[k:]
+
+    return best_lines
+
+
+# Transposition table bound types
+TT_EXACT = 0
+TT_LOWER = 1  # The stored value is a lower bound (fail high)
+TT_UPPER = 2  # The stored value is an upper bound (fail low)
+
+# Maps a state key to (value, depth, bound, best action). The threads of the
+# thread backend share it: entries are only ever replaced whole, and single
+# dict reads and writes are atomic with or without the GIL.
+explored_states: Dict[str, Tuple[int, int, int, int]] = {}
+
+# Cache of positions searched in earlier runs, probed when a state is not in
+# explored_states (see persistent_cache.py). None when no cache is loaded.
+persistent_cache = None
+# Path of the cache file the pool workers write their shards for, None when
+# no cache is used
+persistent_cache_path: Optional[str] = None
+# Keys a pool worker stored in explored_states, written to its shard when it
+# exits. None outside of pool workers writing shards.
+worker_stored_states: Optional[Set[str]] = None
+
+
+def load_persistent_cache(path: str) -> bool:
+    """Start from a cache file of earlier runs, returns whether it is used"""
+    global persistent_cache, persistent_cache_path
+    from persistent_cache import open_cache
+
+    persistent_cache_path = path
+    persistent_cache = open_cache(path, evaluation_weights, search_features)
+    return persistent_cache is not None
+
+
+def save_persistent_cache(path: str) -> int:
+    """
+    Merge explored_states and the shards of the pool workers into a cache
+    file, returns its entry count
+    """
+    from persistent_cache import save_session
+
+    return save_session(path, explored_states, evaluation_weights, search_features)
+
+
+def _write_worker_shard(path: str, engine_pid: int) -> None:
+    """
+    Pool worker exit: dump the entries the worker stored in explored_states
+    (not the ones a forked worker inherited) for the engine's
+    save_persistent_cache
+    """
+    from persistent_cache import evaluation_fingerprint, worker_shard_path, write_shard
+
+    stored_states = {key: explored_states[key] for key in worker_stored_states or ()}
+    if stored_states:
+        write_shard(
+            worker_shard_path(path, engine_pid, os.getpid()),
+            stored_states,
+            evaluation_fingerprint(evaluation_weights, search_features),
+        )
+
+
+# time.monotonic() deadline of the running analysis, 0.0 when there is none
+search_deadline: float = 0.0
+
+# Longest line the search follows
+MAX_PLY = 64
+
+# Returned by the recursive calls, whose lines are in pv_table
+NO_VARIATION: List[int] = []
+
+# Search features that can be switched on and off
+search_features: Dict[str, bool] = {
+    # Search the transposition table move, captures, killers and then
+    # the moves with the best history first
+    "move_ordering": True,
+    # Search late quiet moves one ply shallower, re-searching any that
+    # turn out better than the best move so far
+    "late_move_reductions": False,
+    # Skip quiet moves at frontier nodes whose static value is so far
+    # behind the window that one move cannot catch up
+    "futility_pruning": False,
+    # Let the goats move twice when the tigers are far ahead, verifying
+    # a cutoff with a shallower search of the real moves
+    "null_move": False,
+    # Resolve pending captures at the horizon instead of scoring them
+    # statically
+    "quiescence": True,
+    # Skip goat placements that hang a goat, searching them only when all
+    # the other actions fail high
+    "hanging_drop_pruning": False,
+}
+
+# Longest capture sequence followed by the quiescence search, in moves
+QUIESCENCE_MAX_DEPTH = 6
+
+# Late move reductions apply from this move number and depth on
+LMR_FULL_DEPTH_MOVES = 3
+LMR_MIN_DEPTH = 3
+
+# Null move settings: depth reduction, and how far above beta the static
+# value of a tiger node has to be to try it
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MARGIN = 12
+
+# Counters kept by the search
+SEARCH_STAT_NAMES = (
+    "nodes",
+    "late_move_reductions",
+    "late_move_researches",
+    "futility_prunes",
+    "null_move_tries",
+    "null_move_cutoffs",
+    "quiescence_nodes",
+    "hanging_drops_pruned",
+    "hanging_drop_researches",
+)
+
+
+class SearchState(threading.local):
+    """
+    Tables of the search running in one thread. Every thread gets its own,
+    so the thread backend can search root moves side by side while they
+    share the transposition table and the history scores.
+    """
+
+    def __init__(self):
+        # Triangular principal variation table: pv_table[ply] holds the best
+        # line from the node searched at that ply and pv_length[ply] its
+        # length. The search fills it in place instead of passing lists up
+        # the recursion.
+        self.pv_table: List[List[int]] = [
+            [-1] * (MAX_PLY - ply) for ply in range(MAX_PLY)
+        ]
+        self.pv_length: List[int] = [0] * MAX_PLY
+        # Quiet actions that caused a beta cutoff, two per ply
+        self.killer_moves: List[List[int]] = [[-1, -1] for _ in range(MAX_PLY)]
+        # Off while searching below a null move or verifying one
+        self.null_move_allowed = True
+        # Counters of the searches run in this thread
+        self.stats: Dict[str, int] = dict.fromkeys(SEARCH_STAT_NAMES, 0)
+
+
+search_state = SearchState()
+
+# Counters of the searches run in this process: the main thread's, to which
+# the process and thread backends add the counts of their workers
+search_stats: Dict[str, int] = search_state.stats
+
+# Cutoff history of an action, by player and selected piece (+1). Shared by
+# all threads, a lost update between two of them only affects move ordering.
+history_scores: List[List[List[int]]] = [
+    [[0] * 23 for _ in range(24)] for _ in range(3)
+]
+
+
+def clear_search_heuristics() -> None:
+    """Forget the killer moves and history scores of earlier searches"""
+    for killers in search_state.killer_moves:
+        killers[0] = killers[1] = -1
+    for player_history in history_scores:
+        for action_scores in player_history:
+            action_scores[:] = [0] * 23
+
+
+def get_futility_margin() -> int:
+    """The largest swing in value expected from one quiet action"""
+    weights = evaluation_weights
+    return (
+        abs(weights["blocked_tigers"])
+        + abs(weights["goats_captured"])
+        + abs(weights["capturable_goats"])
+    )
+
+
+def is_capture_action(game_board: Board, action: int) -> bool:
+    """Check if an action captures a goat or selects a tiger that can capture"""
+    if game_board.current_player != 2:
+        return False
+    if game_board.selected_index_to_move != -1:
+        return action in game_board.capture_moves
+
+    board = game_board.board
+    for landing, jumped_over in zip(
+        game_board.tiger_jumpable_indexes[action],
+        game_board.goat_removal_after_tiger_jump_indexes[action],
+    ):
+        if board[landing] == 0 and board[jumped_over] == 1:
+            return True
+    return False
+
+
+def order_actions(
+    game_board: Board, actions: List[int], ply: int, table_action: int
+) -> List[int]:
+    """Sort actions so the ones most likely to cause a cutoff come first"""
+    killers = search_state.killer_moves[ply]
+    history = history_scores[game_board.current_player][
+        game_board.selected_index_to_move + 1
+    ]
+    # Placements go by class: blocking, defended, safe and then hanging drops
+    placement_classes = (
+        classify_placements(game_board) if is_placement_phase(game_board) else None
+    )
+
+    def action_priority(action: int) -> int:
+        if action == table_action:
+            return 1 << 30
+        if placement_classes is not None:
+            if placement_classes[action] == PLACEMENT_BLOCKING:
+                return 1 << 29
+            if action == killers[0] or action == killers[1]:
+                return 1 << 28
+            return (PLACEMENT_HANGING - placement_classes[action] << 24) + history[
+                action
+            ]
+        if is_capture_action(game_board, action):
+            return 1 << 29
+        if action == killers[0] or action == killers[1]:
+            return 1 << 28
+        return history[action]
+
+    return sorted(actions, key=action_priority, reverse=True)
+
+
+def _record_cutoff(game_board: Board, action: int, depth: int, ply: int) -> None:
+    """Remember a quiet action that caused a cutoff"""
+    if is_capture_action(game_board, action):
+        return
+    killers = search_state.killer_moves[ply]
+    if killers[0] != action:
+        killers[1] = killers[0]
+        killers[0] = action
+    history_scores[game_board.current_player][game_board.selected_index_to_move + 1][
+        action
+    ] += (depth * depth)
+
+
+def _build_capture_jumps() -> List[List[Tuple[int, int]]]:
+    """Get the (landing, jumped over) pairs of every cell"""
+    game_board = Board()
+    return [
+        list(zip(landings, jumped_over))
+        for landings, jumped_over in zip(
+            game_board.tiger_jumpable_indexes,
+            game_board.goat_removal_after_tiger_jump_indexes,
+        )
+    ]
+
+
+CAPTURE_JUMPS = _build_capture_jumps()
+
+
+def generate_captures(game_board: Board) -> List[Tuple[int, int]]:
+    """
+    Get the (tiger, landing) capture jumps available to the tigers. When a
+    tiger is selected only its own jumps count.
+    """
+    board = game_board.board
+    if game_board.current_player == 2 and game_board.selected_index_to_move != -1:
+        tigers = [game_board.selected_index_to_move]
+    else:
+        tigers = [i for i in range(23) if board[i] == 2]
+
+    return [
+        (tiger, landing)
+        for tiger in tigers
+        for landing, jumped_over in CAPTURE_JUMPS[tiger]
+        if board[landing] == 0 and board[jumped_over] == 1
+    ]
+
+
+def generate_blocking_moves(
+    game_board: Board, captures: List[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    """
+    Get the (goat or -1 for a placement, landing) goat moves that fill the
+    landing cell of a pending capture
+    """
+    landings = {landing for _, landing in captures}
+    if game_board.goats_placed_count < game_board.total_goats_to_place:
+        return [(-1, landing) for landing in landings]
+
+    board = game_board.board
+    selected = game_board.selected_index_to_move
+    return [
+        (goat, landing)
+        for landing in landings
+        for goat in game_board.reachable_cell_indexes[landing]
+        if board[goat] == 1 and (selected == -1 or goat == selected)
+    ]
+
+
+# Classes of a goat placement, in the order they are searched
+PLACEMENT_BLOCKING = 0  # Fills the landing cell of a capture the tigers have now
+PLACEMENT_DEFENDED = 1  # Next to a tiger that could jump it, but the landing is taken
+PLACEMENT_SAFE = 2  # No tiger can jump over the cell
+PLACEMENT_HANGING = 3  # A tiger can capture the goat on its next move
+
+# Threat masks by tiger configuration (a bitmask of the tiger cells): for
+# every cell, the bitmask of the cells a tiger lands on when jumping over it
+_threat_masks: Dict[int, List[int]] = {}
+
+
+def get_threat_masks(tiger_cells: int) -> List[int]:
+    """Get the threat masks of a tiger configuration, computed once"""
+    masks = _threat_masks.get(tiger_cells)
+    if masks is None:
+        masks = [0] * 23
+        for tiger in range(23):
+            if tiger_cells >> tiger & 1:
+                for landing, jumped_over in CAPTURE_JUMPS[tiger]:
+                    masks[jumped_over] |= 1 << landing
+        _threat_masks[tiger_cells] = masks
+    return masks
+
+
+def classify_placements(game_board: Board) -> Dict[int, int]:
+    """Get the placement class of every empty cell"""
+    board = game_board.board
+    tiger_cells = 0
+    empty_cells = 0
+    goat_cells = []
+    for i in range(23):
+        if board[i] == 0:
+            empty_cells |= 1 << i
+        elif board[i] == 2:
+            tiger_cells |= 1 << i
+        else:
+            goat_cells.append(i)
+    masks = get_threat_masks(tiger_cells)
+
+    # Empty landing cells of the jumps over the goats already placed
+    capture_landings = 0
+    for goat in goat_cells:
+        capture_landings |= masks[goat]
+    capture_landings &= empty_cells
+
+    classes = {}
+    for cell in range(23):
+        if not empty_cells >> cell & 1:
+            continue
+        if capture_landings >> cell & 1:
+            classes[cell] = PLACEMENT_BLOCKING
+        elif not masks[cell]:
+            classes[cell] = PLACEMENT_SAFE
+        elif masks[cell] & empty_cells:
+            classes[cell] = PLACEMENT_HANGING
+        else:
+            classes[cell] = PLACEMENT_DEFENDED
+    return classes
+
+
+def is_placement_phase(game_board: Board) -> bool:
+    return (
+        game_board.current_player == 1
+        and game_board.goats_placed_count < game_board.total_goats_to_place
+    )
+
+
+def quiescence_search(
+    game_board: Board, alpha: int, beta: int, depth: int = QUIESCENCE_MAX_DEPTH
+) -> int:
+    """
+    Extend a horizon node with capture jumps for the tigers and blocks of
+    those jumps for the goats until the position is quiet. Either side may
+    stand pat on the static value instead of continuing the sequence.
+    """
+    search_state.stats["quiescence_nodes"] += 1
+    stand_pat = game_board.get_value(2)
+    if depth == 0 or game_board.game_over:
+        return stand_pat
+
+    captures = generate_captures(game_board)
+    if not captures:
+        return stand_pat
+
+    if game_board.current_player == 2:  # Tiger's turn, try the captures
+        if stand_pat >= beta:
+            return stand_pat
+        value = stand_pat
+        alpha = max(alpha, value)
+        for tiger, landing in captures:
+            child_board = game_board.clone()
+            if child_board.selected_index_to_move == -1:
+                child_board.perform_next_move(tiger)
+            if not child_board.perform_next_move(landing):
+                continue
+            value = max(value, quiescence_search(child_board, alpha, beta, depth - 1))
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+        return value
+    else:  # Goat's turn, try to block the pending captures
+        if stand_pat <= alpha:
+            return stand_pat
+        value = stand_pat
+        beta = min(beta, value)
+        for goat, landing in generate_blocking_moves(game_board, captures):
+            child_board = game_board.clone()
+            if goat != -1 and child_board.selected_index_to_move == -1:
+                child_board.perform_next_move(goat)
+            if not child_board.perform_next_move(landing):
+                continue
+            value = min(value, quiescence_search(child_board, alpha, beta, depth - 1))
+            beta = min(beta, value)
+            if alpha >= beta:
+                break
+        return value
+
+
+def _null_move_search(
+    game_board: Board, depth: int, initial_action: int, beta: int, ply: int
+) -> Optional[int]:
+    """
+    Try to prove a tiger node fails high by giving the goats an extra move.
+    Returns the verified value of a cutoff, or None to search normally.
+    """
+    state = search_state
+    if game_board.get_value(2) < beta + NULL_MOVE_MARGIN:
+        return None
+
+    null_board = game_board.clone()
+    null_board.current_player = 1
+    null_board.update_possible_movable_pieces()
+    if not get_possible_actions(null_board):
+        return None
+
+    state.stats["null_move_tries"] += 1
+    state.null_move_allowed = False
+    try:
+        if search_tracer is not None:
+            search_tracer.kind = TRACE_NULL_MOVE
+            search_tracer.open_node(ply + 1, beta - 1, beta)
+        null_value, _, _ = min_max_with_alpha_beta_pruning(
+            null_board,
+            depth - 1 - NULL_MOVE_REDUCTION,
+            initial_action,
+            False,
+            beta - 1,
+            beta,
+            False,
+            ply + 1,
+        )
+        if search_tracer is not None:
+            # The null move is written as action -1
+            search_tracer.close_node(
+                ply + 1,
+                -1,
+                depth - 1 - NULL_MOVE_REDUCTION,
+                null_value,
+                False,
+                null_value >= beta,
+            )
+        if null_value < beta:
+            return None
+
+        # Zugzwang is common in this game, so check the real moves too
+        if search_tracer is not None:
+            # Written below this node again, so marked apart from its children
+            search_tracer.kind = TRACE_VERIFICATION
+        verified_value, _, _ = min_max_with_alpha_beta_pruning(
+            game_board,
+            depth - NULL_MOVE_REDUCTION,
+            initial_action,
+            True,
+            beta - 1,
+            beta,
+            False,
+            ply,
+        )
+    finally:
+        state.null_move_allowed = True
+        if search_tracer is not None:
+            search_tracer.kind = 0
+
+    if verified_value < beta:
+        state.pv_length[ply] = 0
+        return None
+    state.stats["null_move_cutoffs"] += 1
+    return verified_value
+
+
+# Binary trace record: node id, parent id, ply, action, remaining depth,
+# flags, alpha, beta, value
+TRACE_RECORD = struct.Struct("<iiBbbBiii")
+TRACE_MAXIMIZING = 1
+TRACE_CUTOFF = 2
+# Flags of the nodes of a null move search and of the search verifying it
+TRACE_NULL_MOVE = 4
+TRACE_VERIFICATION = 8
+# Flag of the reduced depth probe of a late move
+TRACE_REDUCED = 16
+TRACE_KINDS = {
+    0: "search",
+    TRACE_NULL_MOVE: "null_move",
+    TRACE_VERIFICATION: "verification",
+    TRACE_REDUCED: "reduced",
+}
+TRACE_KIND_MASK = TRACE_NULL_MOVE | TRACE_VERIFICATION | TRACE_REDUCED
+_INT32_MIN = -(2**31)
+_INT32_MAX = 2**31 - 1
+
+
+class SearchTracer:
+    """
+    Streams the nodes visited by min_max_with_alpha_beta_pruning to a file,
+    one record per node written when its value is known. The tree below
+    every root action (the calls applying their initial action) is written,
+    each node with the id of its parent, so the reader can rebuild it
+    without the search ever holding it in memory.
+
+    Nodes deeper than max_ply are not written. With a sample_rate below 1
+    each subtree is kept with that probability, so every written node still
+    has its parent written. Each process writes its own file: "{pid}" in the
+    path is replaced with the process id, otherwise other processes than the
+    one that created the tracer append ".<pid>" to the path.
+
+    Every node has a kind: "null_move" for the null move (action -1) and
+    the nodes below it, "verification" for the search of the real moves
+    that checks a null move cutoff, whose nodes are written below the same
+    parent as the children of the normal search, and "search" otherwise.
+    A late move reduction writes its probe as a "reduced" node of its own.
+    When the probe is searched again at full depth, the re-search is a
+    sibling with the same action, so the probe can be left out.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        binary: bool = False,
+        max_ply: int = MAX_PLY,
+        sample_rate: float = 1.0,
+        buffer_size: int = 1 << 20,
+        seed: Optional[int] = None,
+    ):
+        self.path = path
+        self.binary = binary
+        self.max_ply = max_ply
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.random = random.Random(seed)
+        self.owner_pid = os.getpid()
+        self.file = None
+        self.file_pid = 0
+        self.next_id = 0
+        # Id (or -1 when it is not written) and window of the open node of each ply
+        self.node_ids = [-1] * (MAX_PLY + 1)
+        self.windows: List[Tuple[int, int]] = [(0, 0)] * (MAX_PLY + 1)
+        # Ply, action, depth and maximizing flag of the open root node
+        self.root: Tuple[int, int, int, bool] = (0, -1, 0, False)
+        # Kind flag of the nodes written, set around null move searches
+        self.kind = 0
+
+    def get_path(self) -> str:
+        """Path of the trace file of the current process"""
+        pid = os.getpid()
+        if "{pid}" in self.path:
+            return self.path.format(pid=pid)
+        if pid == self.owner_pid:
+            return self.path
+        return f"{self.path}.{pid}"
+
+    def _open(self):
+        # A forked process inherits the parent's file, which it must not touch
+        self.file = open(
+            self.get_path(), "ab" if self.binary else "a", buffering=self.buffer_size
+        )
+        self.file_pid = os.getpid()
+        return self.file
+
+    def open_node(self, ply: int, alpha: int, beta: int) -> None:
+        """Start a node below the open node of the previous ply"""
+        if (
+            ply <= self.max_ply
+            and self.node_ids[ply - 1] >= 0
+            and (self.sample_rate >= 1.0 or self.random.random() < self.sample_rate)
+        ):
+            self.node_ids[ply] = self.next_id
+            self.next_id += 1
+            self.windows[ply] = (alpha, beta)
+        else:
+            self.node_ids[ply] = -1
+
+    def close_node(
+        self,
+        ply: int,
+        action: int,
+        depth: int,
+        value: int,
+        maximizing: bool,
+        cutoff: bool,
+        kind: Optional[int] = None,
+    ) -> None:
+        """
+        Write the open node of a ply now that its value is known, with the
+        given kind instead of the current one if set
+        """
+        node_id = self.node_ids[ply]
+        if node_id < 0:
+            return
+        kind = self.kind if kind is None else kind
+        parent_id = self.node_ids[ply - 1] if ply > self.root[0] else -1
+        alpha, beta = self.windows[ply]
+        trace_file = self.file if self.file_pid == os.getpid() else self._open()
+        if self.binary:
+            trace_file.write(
+                TRACE_RECORD.pack(
+                    node_id,
+                    parent_id,
+                    ply,
+                    action,
+                    depth,
+                    (TRACE_MAXIMIZING if maximizing else 0)
+                    | (TRACE_CUTOFF if cutoff else 0)
+                    | kind,
+                    max(_INT32_MIN, min(alpha, _INT32_MAX)),
+                    max(_INT32_MIN, min(beta, _INT32_MAX)),
+                    max(_INT32_MIN, min(value, _INT32_MAX)),
+                )
+            )
+        else:
+            trace_file.write(
+                f'{{"id":{node_id},"parent":{parent_id},"ply":{ply},'
+                f'"action":{action},"depth":{depth},"alpha":{alpha},'
+                f'"beta":{beta},"value":{value},'
+                f'"isMaximizing":{"true" if maximizing else "false"},'
+                f'"cutoff":{"true" if cutoff else "false"},'
+                f'"kind":"{TRACE_KINDS[kind]}"}}\n'
+            )
+
+    def open_root(
+        self, ply: int, action: int, depth: int, maximizing: bool, alpha: int, beta: int
+    ) -> None:
+        """Start the node of a root action, which has no parent"""
+        self.root = (ply, action, depth, maximizing)
+        self.node_ids[ply] = self.next_id
+        self.next_id += 1
+        self.windows[ply] = (alpha, beta)
+
+    def close_root(self, value: int) -> None:
+        ply, action, depth, maximizing = self.root
+        self.close_node(ply, action, depth, value, maximizing, False)
+
+    def __getstate__(self) -> Dict:
+        # Sent to spawned pool workers without the file, they open their own
+        state = dict(self.__dict__)
+        state["file"] = None
+        state["file_pid"] = 0
+        return state
+
+    def flush(self) -> None:
+        if self.file is not None and self.file_pid == os.getpid():
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None and self.file_pid == os.getpid():
+            self.file.close()
+        self.file = None
+
+
+# Tracer of the running searches, None when tracing is off
+search_tracer: Optional[SearchTracer] = None
+
+# Measures the root move batches when set, see memory_profile.py
+search_profiler = None
+
+
+def enable_search_trace(
+    path: str,
+    binary: bool = False,
+    max_ply: int = MAX_PLY,
+    sample_rate: float = 1.0,
+) -> SearchTracer:
+    """Trace the nodes of the following searches to a file"""
+    global search_tracer
+    disable_search_trace()
+    search_tracer = SearchTracer(path, binary, max_ply, sample_rate)
+    atexit.register(search_tracer.close)
+    return search_tracer
+
+
+def disable_search_trace() -> None:
+    global search_tracer
+    if search_tracer is not None:
+        search_tracer.close()
+        search_tracer = None
+
+
+def _init_search_worker(
+    tracer: Optional[SearchTracer],
+    profiler,
+    engine_pid: int,
+    cache_path: Optional[str],
+    weights: Dict[str, int],
+    features: Dict[str, bool],
+    depth_override: Optional[int],
+) -> None:
+    """
+    Pool initializer: evaluate, trace, profile and cache the searches like the
+    engine process. Spawned and forkserver workers do not inherit its state.
+    """
+    global search_tracer, search_profiler, search_depth_override
+    global worker_stored_states
+    # Updated in place, other modules hold on to these dicts
+    evaluation_weights.update(weights)
+    search_features.update(features)
+    search_depth_override = depth_override
+    search_tracer = tracer
+    search_profiler = profiler
+    if cache_path is not None:
+        if persistent_cache is None:
+            load_persistent_cache(cache_path)
+        worker_stored_states = set()
+        # Pool workers skip atexit, finalizers run when the pool is closed
+        Finalize(
+            None,
+            _write_worker_shard,
+            args=(cache_path, engine_pid),
+            exitpriority=10,
+        )
+
+
+def read_search_trace(path: str) -> Iterator[Dict]:
+    """Iterate over the nodes of a trace file written in either format"""
+    with open(path, "rb") as trace_file:
+        if trace_file.read(1) == b"{":
+            trace_file.seek(0)
+            for line in trace_file:
+                yield json.loads(line)
+            return
+        trace_file.seek(0)
+        while True:
+            record = trace_file.read(TRACE_RECORD.size)
+            if len(record) < TRACE_RECORD.size:
+                return
+            node_id, parent_id, ply, action, depth, flags, alpha, beta, value = (
+                TRACE_RECORD.unpack(record)
+            )
+            yield {
+                "id": node_id,
+                "parent": parent_id,
+                "ply": ply,
+                "action": action,
+                "depth": depth,
+                "alpha": alpha,
+                "beta": beta,
+                "value": value,
+                "isMaximizing": bool(flags & TRACE_MAXIMIZING),
+                "cutoff": bool(flags & TRACE_CUTOFF),
+                "kind": TRACE_KINDS[flags & TRACE_KIND_MASK],
+            }
+
+
+def get_state_key(game_board: Board, maximizing_player: bool) -> str:
+    """Get the transposition table key for a state"""
+    board_string = "".join(map(str, game_board.board))
+    player_marker = "M" if maximizing_player else "m"
+    return (
+        f"{board_string}_{player_marker}"
+        f"_{game_board.goats_placed_count}_{game_board.selected_index_to_move}"
+    )
+
+
+def _search_result(
+    value: int, initial_action: int, ply: int, apply_initial_action: bool
+) -> Tuple[int, int, List[int]]:
+    """
+    Get the result to return from a search call, with the principal
+    variation of the calls that applied the initial action
+    """
+    if not apply_initial_action:
+        return value, initial_action, NO_VARIATION
+    if search_tracer is not None:
+        search_tracer.close_root(value)
+    return (
+        value,
+        initial_action,
+        [initial_action] + search_state.pv_table[ply][: search_state.pv_length[ply]],
+    )
 
 
 def min_max_with_alpha_beta_pruning(
@@ -938,18 +2190,19 @@ def min_max_with_alpha_beta_pruning(
     alpha: int,
     beta: int,
     apply_initial_action: bool,
+    ply: int = 0,
 ) -> Tuple[int, int, List[int]]:
-    """Implement the min-max algorithm with alpha-beta pruning"""
-    global explored_states
+    """
+    Implement the min-max algorithm with alpha-beta pruning.
+    Calls that apply the initial action return its principal variation, the
+    recursive calls leave theirs in the pv_table of the thread's SearchState.
+    """
+    state = search_state
 
-    if depth == 0 or game_board.game_over:
-        # Get the value of the board state from current player's perspective
-        # Always evaluate as tiger's perspective, then negate for goat if needed
-        value = game_board.get_value(2)  # Tiger's perspective
-        if not maximizing_player and game_board.current_player == 1:
-            value = -value  # Negate for goat's perspective when minimizing
+    if search_deadline and time.monotonic() > search_deadline:
+        raise SearchTimeout()
 
-        return value, initial_action, game_board.moves_performed
+    state.pv_length[ply] = 0
 
     # Perform the initial action
     if apply_initial_action:
@@ -962,37 +2215,128 @@ def min_max_with_alpha_beta_pruning(
             return (
                 -999999 if maximizing_player else 999999,
                 initial_action,
-                game_board.moves_performed,
+                [],
+            )
+        # The action may have handed the turn to the other player
+        maximizing_player = game_board.current_player == 2
+        if search_tracer is not None:
+            search_tracer.open_root(
+                ply, initial_action, depth, maximizing_player, alpha, beta
             )
 
-    # Check if the state has been explored before
-    board_string = "".join(map(str, game_board.board))
-    player_marker = "M" if maximizing_player else "m"
-    state_key = f"{board_string}_{player_marker}"
+    if depth == 0 or game_board.game_over or ply >= MAX_PLY - 1:
+        # Values are always from the tiger's perspective: the tiger maximizes
+        # them and the goat minimizes them
+        if search_features["quiescence"] and not game_board.game_over:
+            value = quiescence_search(game_board, alpha, beta, QUIESCENCE_MAX_DEPTH)
+        else:
+            value = game_board.get_value(2)
+        return _search_result(value, initial_action, ply, apply_initial_action)
+
+    # Check if the state has been explored before deep enough for this window
+    state_key = get_state_key(game_board, maximizing_player)
+    cached_state = explored_states.get(state_key)
+    if cached_state is None and persistent_cache is not None:
+        cached_state = persistent_cache.get(state_key)
+        if cached_state is not None:
+            explored_states[state_key] = cached_state
+    if cached_state is not None and cached_state[1] >= depth:
+        cached_value, _, bound, cached_action = cached_state
+        if (
+            bound == TT_EXACT
+            or (bound == TT_LOWER and cached_value >= beta)
+            or (bound == TT_UPPER and cached_value <= alpha)
+        ):
+            if cached_action != -1:
+                # The line continues beyond here, but only its first move is known
+                state.pv_table[ply][0] = cached_action
+                state.pv_length[ply] = 1
+            return _search_result(
+                cached_value, initial_action, ply, apply_initial_action
+            )
 
-    if state_key in explored_states:
-        return explored_states[state_key], initial_action, game_board.moves_performed
+    original_alpha, original_beta = alpha, beta
+    state.stats["nodes"] += 1
 
     # Determine valid actions based on the current game state
+    next_action_possible_positions = get_possible_actions(game_board)
+    if search_features["move_ordering"]:
+        next_action_possible_positions = order_actions(
+            game_board,
+            next_action_possible_positions,
+            ply,
+            cached_state[3] if cached_state is not None else -1,
+        )
+
     if (
-        game_board.current_player == 1
-        and game_board.goats_placed_count < game_board.total_goats_to_place
+        search_features["null_move"]
+        and state.null_move_allowed
+        and maximizing_player
+        and game_board.selected_index_to_move == -1
+        and depth > NULL_MOVE_REDUCTION + 1
     ):
-        # Goat placement phase
-        next_action_possible_positions = game_board.get_all_empty_locations()
-    elif game_board.selected_index_to_move == -1:
-        # Selection phase - get all movable pieces
-        next_action_possible_positions = game_board.possible_movable_pieces
-    else:
-        # Destination selection phase
-        next_action_possible_positions = game_board.possible_movable_destinations
+        null_move_value = _null_move_search(
+            game_board, depth, initial_action, beta, ply
+        )
+        if null_move_value is not None:
+            return _search_result(
+                null_move_value, initial_action, ply, apply_initial_action
+            )
+
+    # At frontier nodes a quiet action can only move the value by the margin
+    futile = False
+    if search_features["futility_pruning"] and depth == 1:
+        static_value = game_board.get_value(2)
+        futility_margin = get_futility_margin()
+        if maximizing_player:
+            futile = static_value + futility_margin <= alpha
+        else:
+            # A goat move completing a blockade is worth far more than the margin
+            futile = (
+                static_value - futility_margin >= beta
+                and game_board.count_blocked_tigers() < 2
+            )
 
+    reduce_late_moves = (
+        search_features["late_move_reductions"] and depth >= LMR_MIN_DEPTH
+    )
+
+    # Drops that hang a goat are put off, and only searched when all the
+    # other actions fail high
+    hanging_drops: List[int] = []
+    hanging_drops_searched = False
+    if search_features["hanging_drop_pruning"] and is_placement_phase(game_board):
+        placement_classes = classify_placements(game_board)
+        hanging_drops = [
+            action
+            for action in next_action_possible_positions
+            if placement_classes[action] == PLACEMENT_HANGING
+        ]
+        if len(hanging_drops) < len(next_action_possible_positions):
+            next_action_possible_positions = [
+                action
+                for action in next_action_possible_positions
+                if placement_classes[action] != PLACEMENT_HANGING
+            ]
+            state.stats["hanging_drops_pruned"] += len(hanging_drops)
+        else:
+            hanging_drops = []
+
+    best_action = -1
+    variation = state.pv_table[ply]
+    child_variation = state.pv_table[ply + 1]
+    move_number = 0
     if maximizing_player:  # Tiger's turn
         value = -9999999
-        moves_performed = []
 
         for next_action_position in next_action_possible_positions:
-            game_board_copied: Board = copy.deepcopy(game_board)  # type: ignore
+            is_quiet = not is_capture_action(game_board, next_action_position)
+            if futile and is_quiet:
+                state.stats["futility_prunes"] += 1
+                value = max(value, static_value + futility_margin)
+                continue
+
+            game_board_copied = game_board.clone()
             success = game_board_copied.perform_next_move(next_action_position)
 
             if not success:
@@ -1000,64 +2344,472 @@ def min_max_with_alpha_beta_pruning(
 
             # Next player's turn - reverse maximizing flag
             next_maximizing = game_board_copied.current_player == 2
-
-            min_max_value, _, next_moves_performed = min_max_with_alpha_beta_pruning(
-                game_board_copied,
-                depth - 1,
-                initial_action,
-                next_maximizing,
-                alpha,
-                beta,
-                False,
-            )
+            move_number += 1
+
+            full_depth_search = True
+            if reduce_late_moves and is_quiet and move_number > LMR_FULL_DEPTH_MOVES:
+                state.stats["late_move_reductions"] += 1
+                if search_tracer is not None:
+                    search_tracer.open_node(ply + 1, alpha, alpha + 1)
+                # A null window probe only tells whether the move beats alpha
+                min_max_value, _, _ = min_max_with_alpha_beta_pruning(
+                    game_board_copied,
+                    depth - 2,
+                    initial_action,
+                    next_maximizing,
+                    alpha,
+                    alpha + 1,
+                    False,
+                    ply + 1,
+                )
+                # Only a move that beats the best so far needs its full depth
+                full_depth_search = min_max_value > alpha
+                if full_depth_search:
+                    state.stats["late_move_researches"] += 1
+                if search_tracer is not None:
+                    search_tracer.close_node(
+                        ply + 1,
+                        next_action_position,
+                        depth - 2,
+                        min_max_value,
+                        next_maximizing,
+                        False,
+                        TRACE_REDUCED,
+                    )
+
+            if full_depth_search:
+                if search_tracer is not None:
+                    search_tracer.open_node(ply + 1, alpha, beta)
+                min_max_value, _, _ = min_max_with_alpha_beta_pruning(
+                    game_board_copied,
+                    depth - 1,
+                    initial_action,
+                    next_maximizing,
+                    alpha,
+                    beta,
+                    False,
+                    ply + 1,
+                )
 
             if min_max_value > value:
                 value = min_max_value
-                moves_performed = next_moves_performed
+                best_action = next_action_position
+                # This move followed by the child's line is the new best line
+                child_length = state.pv_length[ply + 1]
+                variation[0] = next_action_position
+                variation[1 : child_length + 1] = child_variation[:child_length]
+                state.pv_length[ply] = child_length + 1
 
             alpha = max(alpha, value)
+            if search_tracer is not None and full_depth_search:
+                search_tracer.close_node(
+                    ply + 1,
+                    next_action_position,
+                    depth - 1,
+                    min_max_value,
+                    next_maximizing,
+                    alpha >= beta,
+                )
             if alpha >= beta:
+                _record_cutoff(game_board, next_action_position, depth, ply)
                 break
-
-        # Cache the value for this state
-        explored_states[state_key] = value
-        return value, initial_action, moves_performed
     else:  # Goat's turn
         value = 9999999
-        moves_performed = []
 
-        for next_action_position in next_action_possible_positions:
-            game_board_copied: Board = copy.deepcopy(game_board)  # type: ignore
-            success = game_board_copied.perform_next_move(next_action_position)
+        action_groups = [next_action_possible_positions]
+        if hanging_drops:
+            action_groups.append(hanging_drops)
+        for group_number, group_actions in enumerate(action_groups):
+            if group_number == 1:
+                # The pruned drops are searched when nothing else kept the
+                # value below beta
+                if alpha >= beta or (value < original_beta and move_number > 0):
+                    break
+                state.stats["hanging_drop_researches"] += 1
+                hanging_drops_searched = True
 
-            if not success:
+            for next_action_position in group_actions:
+                is_quiet = not is_capture_action(game_board, next_action_position)
+                if futile and is_quiet:
+                    state.stats["futility_prunes"] += 1
+                    value = min(value, static_value - futility_margin)
+                    continue
+
+                game_board_copied = game_board.clone()
+                success = game_board_copied.perform_next_move(next_action_position)
+
+                if not success:
+                    continue
+
+                # Next player's turn - reverse maximizing flag
+                next_maximizing = game_board_copied.current_player == 2
+                move_number += 1
+
+                full_depth_search = True
+                if (
+                    reduce_late_moves
+                    and is_quiet
+                    and move_number > LMR_FULL_DEPTH_MOVES
+                ):
+                    state.stats["late_move_reductions"] += 1
+                    if search_tracer is not None:
+                        search_tracer.open_node(ply + 1, beta - 1, beta)
+                    # A null window probe only tells whether the move beats beta
+                    min_max_value, _, _ = min_max_with_alpha_beta_pruning(
+                        game_board_copied,
+                        depth - 2,
+                        initial_action,
+                        next_maximizing,
+                        beta - 1,
+                        beta,
+                        False,
+                        ply + 1,
+                    )
+                    # Only a move that beats the best so far needs its full depth
+                    full_depth_search = min_max_value < beta
+                    if full_depth_search:
+                        state.stats["late_move_researches"] += 1
+                    if search_tracer is not None:
+                        search_tracer.close_node(
+                            ply + 1,
+                            next_action_position,
+                            depth - 2,
+                            min_max_value,
+                            next_maximizing,
+                            False,
+                            TRACE_REDUCED,
+                        )
+
+                if full_depth_search:
+                    if search_tracer is not None:
+                        search_tracer.open_node(ply + 1, alpha, beta)
+                    min_max_value, _, _ = min_max_with_alpha_beta_pruning(
+                        game_board_copied,
+                        depth - 1,
+                        initial_action,
+                        next_maximizing,
+                        alpha,
+                        beta,
+                        False,
+                        ply + 1,
+                    )
+
+                if min_max_value < value:
+                    value = min_max_value
+                    best_action = next_action_position
+                    # This move followed by the child's line is the new best line
+                    child_length = state.pv_length[ply + 1]
+                    variation[0] = next_action_position
+                    variation[1 : child_length + 1] = child_variation[:child_length]
+                    state.pv_length[ply] = child_length + 1
+
+                beta = min(beta, value)
+                if search_tracer is not None and full_depth_search:
+                    search_tracer.close_node(
+                        ply + 1,
+                        next_action_position,
+                        depth - 1,
+                        min_max_value,
+                        next_maximizing,
+                        alpha >= beta,
+                    )
+                if alpha >= beta:
+                    _record_cutoff(game_board, next_action_position, depth, ply)
+                    break
+
+    # Cache the value for this state along with the kind of bound it is
+    if hanging_drops and not hanging_drops_searched:
+        # The skipped moves could only make the value better for the side
+        # to move, so it is a bound even inside the window
+        bound = TT_LOWER if maximizing_player else TT_UPPER
+    elif value <= original_alpha:
+        bound = TT_UPPER
+    elif value >= original_beta:
+        bound = TT_LOWER
+    else:
+        bound = TT_EXACT
+    explored_states[state_key] = (value, depth, bound, best_action)
+    if worker_stored_states is not None:
+        worker_stored_states.add(state_key)
+    return _search_result(value, initial_action, ply, apply_initial_action)
+
+
+# Proof-number search results
+PROVEN = 1
+DISPROVEN = -1
+UNKNOWN = 0
+
+PN_INFINITY = 10**9
+
+# Score of a position proven to be won, from the tiger's perspective
+PROVEN_WIN_SCORE = 1000
+
+# Run the solver before the heuristic search when an endgame is near
+use_proof_solver = True
+solver_node_budget = 20000
+solver_max_entries = 200000
+solver_max_ply = 8
+
+
+class ProofSearchAborted(Exception):
+    """Raised when the proof search runs out of its node or memory budget"""
+
+
+class ProofNumberSolver:
+    """
+    Depth-first proof-number (df-pn) solver trying to prove that one side can
+    force a goal from a position.
+
+    Goals:
+    - "goat_blockade": the goats block all tigers
+    - "tiger_win": the tigers capture all goats
+
+    Both goals end the game, so a proof is an exact result. find_forced_win
+    runs the solver at the root of a move, before the heuristic search.
+
+    Proofs are bounded by max_ply half-moves (piece selections count as a
+    half-move), so DISPROVEN means "cannot be forced within max_ply".
+    """
+
+    def __init__(
+        self,
+        goal: Literal["goat_blockade", "tiger_win"],
+        max_ply: int = 12,
+        node_budget: int = 100000,
+        max_entries: int = 500000,
+    ):
+        self.goal = goal
+        self.max_ply = max_ply
+        self.node_budget = node_budget
+        self.max_entries = max_entries
+        self.attacker = 1 if goal == "goat_blockade" else 2
+        self.nodes = 0
+        # Maps (state key, remaining plies) to (proof number, disproof number)
+        self.table: Dict[Tuple[str, int], Tuple[int, int]] = {}
+
+    def solve(self, game_board: Board) -> Tuple[int, int, int]:
+        """
+        Try to prove the goal from the given state.
+        Returns (PROVEN / DISPROVEN / UNKNOWN, proving action or -1, nodes searched)
+        """
+        self.nodes = 0
+        root_key = (
+            get_state_key(game_board, game_board.current_player == 2),
+            self.max_ply,
+        )
+
+        try:
+            self._multiple_iterative_deepening(
+                game_board, root_key, self.max_ply, PN_INFINITY, PN_INFINITY
+            )
+        except ProofSearchAborted:
+            return UNKNOWN, -1, self.nodes
+
+        proof_number, _ = self.table[root_key]
+        if proof_number != 0:
+            return DISPROVEN, -1, self.nodes
+
+        # Pick the child that completes the proof
+        best_action = -1
+        if game_board.current_player == self.attacker:
+            for action, child_board, child_key in self._expand(
+                game_board, self.max_ply
+            ):
+                child_result = self._terminal_numbers(child_board, self.max_ply - 1)
+                if child_result is None:
+                    child_result = self.table.get(child_key, (1, 1))
+                if child_result[0] == 0:
+                    best_action = action
+                    break
+        return PROVEN, best_action, self.nodes
+
+    def _terminal_numbers(
+        self, game_board: Board, remaining: int
+    ) -> Optional[Tuple[int, int]]:
+        """Get the proof and disproof numbers of a decided state, or None"""
+        if self.goal == "goat_blockade":
+            if game_board.game_over:
+                return (0, PN_INFINITY) if game_board.winner == 1 else (PN_INFINITY, 0)
+        else:
+            if game_board.goats_captured_count >= game_board.total_goats_to_place:
+                return 0, PN_INFINITY
+            if game_board.game_over:
+                return PN_INFINITY, 0
+
+        if remaining <= 0 or not get_possible_actions(game_board):
+            return PN_INFINITY, 0
+        return None
+
+    def _expand(
+        self, game_board: Board, remaining: int
+    ) -> List[Tuple[int, Board, Tuple[str, int]]]:
+        """Generate the (action, board, table key) children of a state"""
+        children = []
+        for action in get_possible_actions(game_board):
+            child_board = game_board.clone()
+            if not child_board.perform_next_move(action):
                 continue
+            child_key = (
+                get_state_key(child_board, child_board.current_player == 2),
+                remaining - 1,
+            )
+            children.append((action, child_board, child_key))
+        return children
+
+    def _store(self, key: Tuple[str, int], numbers: Tuple[int, int]) -> None:
+        """Store proof numbers, keeping the table inside its memory budget"""
+        if len(self.table) >= self.max_entries and key not in self.table:
+            # Drop the unresolved entries first, decided ones are worth keeping
+            self.table = {
+                stored_key: stored
+                for stored_key, stored in self.table.items()
+                if stored[0] == 0 or stored[1] == 0
+            }
+            if len(self.table) >= self.max_entries:
+                raise ProofSearchAborted()
+        self.table[key] = numbers
+
+    def _multiple_iterative_deepening(
+        self,
+        game_board: Board,
+        key: Tuple[str, int],
+        remaining: int,
+        proof_threshold: int,
+        disproof_threshold: int,
+    ) -> None:
+        """Expand a node until its proof or disproof number reaches its threshold"""
+        self.nodes += 1
+        if self.nodes > self.node_budget:
+            raise ProofSearchAborted()
+
+        terminal = self._terminal_numbers(game_board, remaining)
+        if terminal is not None:
+            self._store(key, terminal)
+            return
 
-            # Next player's turn - reverse maximizing flag
-            next_maximizing = game_board_copied.current_player == 2
+        is_or_node = game_board.current_player == self.attacker
+        children = self._expand(game_board, remaining)
+
+        while True:
+            child_numbers = []
+            for _, child_board, child_key in children:
+                numbers = self.table.get(child_key)
+                if numbers is None:
+                    numbers = self._terminal_numbers(child_board, remaining - 1)
+                    if numbers is not None:
+                        self._store(child_key, numbers)
+                    else:
+                        numbers = (1, 1)
+                child_numbers.append(numbers)
+
+            if is_or_node:
+                proof_number = min((n[0] for n in child_numbers), default=PN_INFINITY)
+                disproof_number = min(sum(n[1] for n in child_numbers), PN_INFINITY)
+            else:
+                proof_number = min(sum(n[0] for n in child_numbers), PN_INFINITY)
+                disproof_number = min(
+                    (n[1] for n in child_numbers), default=PN_INFINITY
+                )
 
-            min_max_value, _, next_moves_performed = min_max_with_alpha_beta_pruning(
-                game_board_copied,
-                depth - 1,
-                initial_action,
-                next_maximizing,
-                alpha,
-                beta,
-                False,
+            if proof_number >= proof_threshold or disproof_number >= disproof_threshold:
+                self._store(key, (proof_number, disproof_number))
+                return
+
+            # The most proving child and the runner-up in the same measure
+            measure = 0 if is_or_node else 1
+            order = sorted(
+                range(len(child_numbers)), key=lambda i: child_numbers[i][measure]
+            )
+            best = order[0]
+            second_best = (
+                child_numbers[order[1]][measure] if len(order) > 1 else PN_INFINITY
             )
+            best_proof, best_disproof = child_numbers[best]
 
-            if min_max_value < value:
-                value = min_max_value
-                moves_performed = next_moves_performed
+            if is_or_node:
+                child_proof_threshold = min(proof_threshold, second_best + 1)
+                child_disproof_threshold = (
+                    disproof_threshold - disproof_number + best_disproof
+                )
+            else:
+                child_proof_threshold = proof_threshold - proof_number + best_proof
+                child_disproof_threshold = min(disproof_threshold, second_best + 1)
+
+            _, child_board, child_key = children[best]
+            self._multiple_iterative_deepening(
+                child_board,
+                child_key,
+                remaining - 1,
+                min(child_proof_threshold, PN_INFINITY),
+                min(child_disproof_threshold, PN_INFINITY),
+            )
 
-            beta = min(beta, value)
-            if alpha >= beta:
-                break
 
-        # Cache the value for this state
-        explored_states[state_key] = value
-        return value, initial_action, moves_performed
+def find_forced_win(game_board: Board) -> Optional[Tuple[int, int, List[int]]]:
+    """
+    Try to prove a forced win for the player to move within the solver budget.
+    Returns an exact (score, move, []) result, or None when nothing was proven.
+    """
+    if game_board.current_player == 1:
+        goal = "goat_blockade"
+    elif (
+        game_board.goats_placed_count == game_board.total_goats_to_place
+        and game_board.goats_placed_count - game_board.goats_captured_count <= 2
+    ):
+        goal = "tiger_win"
+    else:
+        return None
+
+    solver = ProofNumberSolver(
+        goal,  # type: ignore
+        max_ply=solver_max_ply,
+        node_budget=solver_node_budget,
+        max_entries=solver_max_entries,
+    )
+    result, action, nodes = solver.solve(game_board.clone())
+    print(f"Proof search: {nodes} nodes, result {result}")
+    if result != PROVEN or action == -1:
+        return None
+
+    score = PROVEN_WIN_SCORE if goal == "tiger_win" else -PROVEN_WIN_SCORE
+    return (score, action, [])
 
 
 if __name__ == "__main__":
-    start_game()
+    parser = argparse.ArgumentParser(description="Tigers and Goats game")
+    parser.add_argument(
+        "--weights", help="JSON file with evaluation weights to use for the AI"
+    )
+    parser.add_argument("--record", help="Game record file to append the game to")
+    parser.add_argument(
+        "--cache", help="Persistent position cache to start from and add the game to"
+    )
+    parser.add_argument(
+        "--trace", help="File to stream the searched nodes to, as JSON lines"
+    )
+    parser.add_argument(
+        "--trace-max-ply", type=int, default=MAX_PLY, help="Deepest ply to trace"
+    )
+    parser.add_argument(
+        "--trace-sample-rate",
+        type=float,
+        default=1.0,
+        help="Fraction of the subtrees to trace",
+    )
+    arguments = parser.parse_args()
+    if arguments.weights:
+        load_evaluation_weights(arguments.weights)
+    if arguments.trace:
+        enable_search_trace(
+            arguments.trace,
+            max_ply=arguments.trace_max_ply,
+            sample_rate=arguments.trace_sample_rate,
+        )
+    if arguments.cache:
+        load_persistent_cache(arguments.cache)
+
+    start_game(arguments.record)
+
+    if arguments.cache:
+        entry_count = save_persistent_cache(arguments.cache)
+        print(f"{arguments.cache} now holds {entry_count} positions")
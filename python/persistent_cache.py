@@ -0,0 +1,308 @@
+"""
+Persistent transposition cache shared by the engine across runs
+
+The cache is an open-addressing hash table in a file, memory-mapped by the
+engine, so opening it takes the same time whatever its size and only the
+pages that are probed are read. The engine looks positions up in it when
+they are missing from explored_states.
+
+    header:  magic "TGCACHE" (8 bytes), version (uint32), slot count
+             (uint32, a power of two), entry count (uint64), fingerprint
+             of the evaluation settings (uint64)
+    slots:   position hash (uint64, 0 for an empty slot), value (int32),
+             depth (uint8), bound (uint8), best action (int8), padding
+
+A position hash is the first 8 bytes of the BLAKE2b digest of the engine's
+state key. Values are only valid for the evaluation weights and search
+features they were searched with, so a cache is only used by an engine
+whose settings have the same fingerprint.
+
+The cache is never written while a game is running. The pool workers of
+a parallel search each dump the entries they added to explored_states to a
+shard file when the pool is closed, and at the end of a session the engine
+dumps its own explored_states to a shard too. The engine's shard and its
+workers' shards are merged into the cache under a file lock. Where a position
+is in more than one, the deeper entry wins. A merge writes a new cache file
+and swaps it in, so engines that have the old one mapped are not affected.
+
+Thread pool workers fill the engine's own explored_states, so their entries
+are saved with it. The workers of distributed_search.py keep their tables
+for one search only, and nothing of them is saved.
+
+Usage:
+    python min_max_with_alpha_beta.py --cache positions.tgc
+    python persistent_cache.py merge positions.tgc shard1 shard2
+    python persistent_cache.py stats positions.tgc
+"""
+
+import argparse
+import fcntl
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+HEADER = struct.Struct("<8sIIQQ")
+MAGIC = b"TGCACHE\x00"
+VERSION = 1
+SLOT = struct.Struct("<QiBBbx")
+
+# Slots looked at from the home slot of a hash before giving up
+PROBE_LIMIT = 8
+# The table is grown when a merge would fill more of it than this
+MAX_LOAD = 0.7
+MIN_SLOTS = 1 << 16
+
+
+def position_hash(state_key: str) -> int:
+    """64-bit hash of a state key, stable across processes, never 0"""
+    digest = hashlib.blake2b(state_key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def evaluation_fingerprint(weights: Dict[str, int], features: Dict[str, bool]) -> int:
+    """Hash of the engine settings that the cached values depend on"""
+    return position_hash(json.dumps([weights, features], sort_keys=True))
+
+
+class PersistentCache:
+    """Read-only memory-mapped view of a cache file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.slot_count, self.entry_count, self.fingerprint = (
+            HEADER.unpack_from(self.data)
+        )
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} cache file")
+        self.mask = self.slot_count - 1
+
+    def __len__(self) -> int:
+        return self.entry_count
+
+    def get(self, state_key: str) -> Optional[Tuple[int, int, int, int]]:
+        """Look up a state key, returns (value, depth, bound, best action)"""
+        key = position_hash(state_key)
+        for probe in range(PROBE_LIMIT):
+            slot = (key + probe) & self.mask
+            slot_key, value, depth, bound, action = SLOT.unpack_from(
+                self.data, HEADER.size + slot * SLOT.size
+            )
+            if slot_key == key:
+                return value, depth, bound, action
+            if slot_key == 0:
+                return None
+        return None
+
+    def entries(self) -> Iterator[Tuple[int, int, int, int, int]]:
+        """Iterate over (hash, value, depth, bound, best action)"""
+        for slot_key, value, depth, bound, action in SLOT.iter_unpack(
+            self.data[HEADER.size : HEADER.size + self.slot_count * SLOT.size]
+        ):
+            if slot_key:
+                yield slot_key, value, depth, bound, action
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self) -> "PersistentCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def open_cache(
+    path: str, weights: Dict[str, int], features: Dict[str, bool]
+) -> Optional[PersistentCache]:
+    """Open a cache file if it exists and was built with these settings"""
+    if not os.path.exists(path):
+        return None
+    cache = PersistentCache(path)
+    if cache.fingerprint != evaluation_fingerprint(weights, features):
+        print(f"Not using {path}: it was built with other evaluation settings")
+        cache.close()
+        return None
+    print(f"Loaded {len(cache)} cached positions from {path}")
+    return cache
+
+
+def write_shard(path: str, explored_states: Dict, fingerprint: int) -> int:
+    """Dump a transposition table as a shard for merge_shards, returns its size"""
+    with open(path, "wb") as shard_file:
+        shard_file.write(
+            HEADER.pack(MAGIC, VERSION, 0, len(explored_states), fingerprint)
+        )
+        for state_key, (value, depth, bound, action) in explored_states.items():
+            shard_file.write(
+                SLOT.pack(position_hash(state_key), value, depth, bound, action)
+            )
+    return len(explored_states)
+
+
+def worker_shard_path(cache_path: str, engine_pid: int, worker_pid: int) -> str:
+    """Shard file of a pool worker, which save_session picks up"""
+    return f"{cache_path}.worker-{engine_pid}-{worker_pid}.shard"
+
+
+def worker_shard_paths(cache_path: str, engine_pid: int) -> List[str]:
+    """Shard files left by the pool workers of an engine process"""
+    return glob.glob(glob.escape(f"{cache_path}.worker-{engine_pid}-") + "*.shard")
+
+
+def _read_shard(path: str) -> Tuple[int, List[Tuple[int, int, int, int, int]]]:
+    """Read a shard, returns (fingerprint, entries)"""
+    with open(path, "rb") as shard_file:
+        data = shard_file.read()
+    magic, version, _, entry_count, fingerprint = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} cache shard")
+    end = HEADER.size + entry_count * SLOT.size
+    return fingerprint, list(SLOT.iter_unpack(data[HEADER.size : end]))
+
+
+def _insert(table: bytearray, mask: int, entry: Tuple) -> int:
+    """
+    Insert an entry into a table, keeping the deeper of two entries of a
+    position. Returns 1 if it took an empty slot, else 0.
+    """
+    key, _, depth, _, _ = entry
+    shallowest_offset = -1
+    shallowest_depth = 256
+    for probe in range(PROBE_LIMIT):
+        offset = HEADER.size + ((key + probe) & mask) * SLOT.size
+        slot_key, _, slot_depth, _, _ = SLOT.unpack_from(table, offset)
+        if slot_key == 0 or slot_key == key:
+            if slot_key == 0 or depth >= slot_depth:
+                SLOT.pack_into(table, offset, *entry)
+            return 1 if slot_key == 0 else 0
+        if slot_depth < shallowest_depth:
+            shallowest_offset, shallowest_depth = offset, slot_depth
+    # No room near the home slot: evict the shallowest entry if this is deeper
+    if depth >= shallowest_depth:
+        SLOT.pack_into(table, shallowest_offset, *entry)
+    return 0
+
+
+def _build_table(
+    slot_count: int, fingerprint: int, entries: List[Tuple]
+) -> Tuple[bytearray, int]:
+    """Build a cache file image from entries, returns (image, entry count)"""
+    table = bytearray(HEADER.size + slot_count * SLOT.size)
+    entry_count = 0
+    for entry in entries:
+        entry_count += _insert(table, slot_count - 1, entry)
+    HEADER.pack_into(table, 0, MAGIC, VERSION, slot_count, entry_count, fingerprint)
+    return table, entry_count
+
+
+def merge_shards(cache_path: str, shard_paths: List[str], remove: bool = True) -> int:
+    """
+    Merge shards into a cache file, creating it if needed. Writers are
+    serialised with a lock file next to the cache. Returns the entry count.
+    """
+    with open(cache_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        entries: List[Tuple] = []
+        fingerprint = None
+        if os.path.exists(cache_path):
+            with PersistentCache(cache_path) as cache:
+                fingerprint = cache.fingerprint
+                entries.extend(cache.entries())
+
+        merged_paths = []
+        for shard_path in shard_paths:
+            shard_fingerprint, shard_entries = _read_shard(shard_path)
+            if fingerprint is None:
+                fingerprint = shard_fingerprint
+            if shard_fingerprint != fingerprint:
+                print(
+                    f"Skipping {shard_path}: other evaluation settings than the cache"
+                )
+                continue
+            entries.extend(shard_entries)
+            merged_paths.append(shard_path)
+        if fingerprint is None:
+            return 0
+
+        # Shallow entries first, so deeper ones replace them
+        entries.sort(key=lambda entry: entry[2])
+        slot_count = MIN_SLOTS
+        while slot_count * MAX_LOAD < len(entries):
+            slot_count *= 2
+        table, entry_count = _build_table(slot_count, fingerprint, entries)
+
+        # Readers keep the file they mapped, the new one is swapped in whole
+        temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as cache_file:
+            cache_file.write(table)
+            cache_file.flush()
+            os.fsync(cache_file.fileno())
+        os.replace(temporary_path, cache_path)
+
+        if remove:
+            for shard_path in merged_paths:
+                os.remove(shard_path)
+        return entry_count
+
+
+def save_session(
+    cache_path: str,
+    explored_states: Dict,
+    weights: Dict[str, int],
+    features: Dict[str, bool],
+) -> int:
+    """
+    Add a transposition table and the shards of this process's pool workers
+    to a cache file, returns its entry count
+    """
+    shard_path = f"{cache_path}.{os.getpid()}.shard"
+    write_shard(shard_path, explored_states, evaluation_fingerprint(weights, features))
+    return merge_shards(
+        cache_path, [shard_path] + worker_shard_paths(cache_path, os.getpid())
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage persistent cache files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="Merge shards into a cache")
+    merge_parser.add_argument("cache")
+    merge_parser.add_argument("shards", nargs="+")
+    merge_parser.add_argument(
+        "--keep", action="store_true", help="Keep the shards once merged"
+    )
+    stats_parser = subparsers.add_parser("stats", help="Describe a cache file")
+    stats_parser.add_argument("cache")
+    arguments = parser.parse_args()
+
+    if arguments.command == "merge":
+        entry_count = merge_shards(
+            arguments.cache, arguments.shards, remove=not arguments.keep
+        )
+        print(f"{arguments.cache} holds {entry_count} positions")
+    else:
+        from min_max_with_alpha_beta import evaluation_weights, search_features
+
+        fingerprint = evaluation_fingerprint(evaluation_weights, search_features)
+        with PersistentCache(arguments.cache) as cache:
+            depths: Dict[int, int] = {}
+            for _, _, depth, _, _ in cache.entries():
+                depths[depth] = depths.get(depth, 0) + 1
+            print(f"Positions: {len(cache)} in {cache.slot_count} slots")
+            print(f"Load: {len(cache) / cache.slot_count:.1%}")
+            print(f"Matches the default settings: {cache.fingerprint == fingerprint}")
+            for depth in sorted(depths):
+                print(f"Depth {depth}: {depths[depth]}")
+
+
+if __name__ == "__main__":
+    main()
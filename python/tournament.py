@@ -0,0 +1,430 @@
+"""
+Engine-vs-engine matches between two configurations of get_next_best_move
+
+Each engine is a JSON file, or "default" for the engine as it is:
+
+    {
+        "name": "lmr-depth-4",
+        "depth": 4,
+        "weights": {"capturable_goats": 4},
+        "features": {"late_move_reductions": true}
+    }
+
+where depth fixes the search depth (the depth is picked by the state when
+it is missing), weights is a dict or the path of a weights file overriding
+some of evaluation_weights and features overrides some of search_features.
+
+Games are played in pairs from a shared set of openings: every opening is
+played once with each engine as the tigers, which cancels out most of the
+bias of the opening. Pairs run in parallel in a process pool. Games still
+running after a maximum number of actions are adjudicated as draws.
+
+The match reports the score and Elo difference of the first engine, with a
+95% confidence interval computed from the pair results. With --sprt the
+match stops as soon as a sequential probability ratio test accepts either
+H0 (the Elo difference is elo0) or H1 (it is elo1).
+
+Usage:
+    python tournament.py new.json default --games 400
+    python tournament.py new.json default --games 20000 --sprt 0 10
+"""
+
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import sys
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import min_max_with_alpha_beta as engine
+from min_max_with_alpha_beta import Board, get_possible_actions
+
+# The engine settings before any configuration is applied
+DEFAULT_WEIGHTS = dict(engine.evaluation_weights)
+DEFAULT_FEATURES = dict(engine.search_features)
+
+
+class EngineConfig(NamedTuple):
+    name: str
+    depth: Optional[int] = None
+    weights: Optional[Dict[str, int]] = None
+    features: Optional[Dict[str, bool]] = None
+
+
+def load_engine_config(spec: str) -> EngineConfig:
+    """Load an engine configuration from a JSON file, or "default" """
+    if spec == "default":
+        return EngineConfig("default")
+
+    with open(spec) as config_file:
+        config = json.load(config_file)
+    weights = config.get("weights")
+    if isinstance(weights, str):
+        with open(weights) as weights_file:
+            weights = json.load(weights_file)
+
+    unknown_features = set(weights or {}) - set(DEFAULT_WEIGHTS)
+    unknown_features |= set(config.get("features") or {}) - set(DEFAULT_FEATURES)
+    if unknown_features:
+        raise ValueError(
+            f"Unknown engine settings in {spec}: {sorted(unknown_features)}"
+        )
+
+    return EngineConfig(
+        config.get("name", os.path.splitext(os.path.basename(spec))[0]),
+        config.get("depth"),
+        weights,
+        config.get("features"),
+    )
+
+
+# Transposition table of each engine of the match, in a worker
+_transposition_tables: List[Dict] = [{}, {}]
+
+
+def use_engine(config: EngineConfig, engine_number: int) -> None:
+    """Set up the search globals of this process for one engine"""
+    engine.evaluation_weights.update(DEFAULT_WEIGHTS)
+    engine.evaluation_weights.update(config.weights or {})
+    engine.search_features.update(DEFAULT_FEATURES)
+    engine.search_features.update(config.features or {})
+    engine.search_depth_override = config.depth
+    # Entries scored with other weights must not leak between the engines
+    engine.explored_states = _transposition_tables[engine_number]
+
+
+def _init_worker() -> None:
+    """Pool initializer: quiet engine output and no pools inside the pool"""
+    sys.stdout = open(os.devnull, "w")
+    engine.search_dispatch = "serial"
+
+
+def random_openings(count: int, moves: int, seed: int = 0) -> List[List[int]]:
+    """
+    Generate distinct openings of random moves from the start position, as
+    lists of actions. A move is a placement, or a selection and a destination.
+    """
+    rng = random.Random(seed)
+    openings: List[List[int]] = []
+    seen = set()
+    attempts = 0
+    while len(openings) < count and attempts < count * 100:
+        attempts += 1
+        game_board = Board()
+        actions: List[int] = []
+        while len(game_board.move_pairs) < moves and not game_board.game_over:
+            possible_actions = get_possible_actions(game_board)
+            if not possible_actions:
+                break
+            action = rng.choice(possible_actions)
+            if game_board.perform_action(action):
+                actions.append(action)
+        if game_board.game_over:
+            continue
+        position = game_board.to_position_string()
+        if position not in seen:
+            seen.add(position)
+            openings.append(actions)
+    return openings
+
+
+def read_openings(path: str) -> List[List[int]]:
+    """Read openings, one per line as space separated actions"""
+    with open(path) as openings_file:
+        return [
+            [int(action) for action in line.split()]
+            for line in openings_file
+            if line.strip()
+        ]
+
+
+def play_game(
+    opening: List[int],
+    tiger: EngineConfig,
+    goat: EngineConfig,
+    tiger_number: int,
+    max_actions: int,
+) -> Tuple[int, List[int], int]:
+    """
+    Play one game from an opening, returns (winner, actions played, goats
+    captured).
+    tiger_number is the engine number (0 or 1) of the tiger engine.
+    """
+    game_board = Board()
+    actions: List[int] = []
+    for action in opening:
+        game_board.perform_action(action)
+        actions.append(action)
+    for table in _transposition_tables:
+        table.clear()
+
+    while not game_board.game_over and len(actions) < max_actions:
+        if game_board.current_player == 2:
+            use_engine(tiger, tiger_number)
+        else:
+            use_engine(goat, 1 - tiger_number)
+        best_move = engine.get_next_best_move(game_board)
+        if game_board.perform_next_move(best_move[1]):
+            actions.append(best_move[1])
+            continue
+
+        # Like start_game, fall back to the first action that is valid
+        for action in get_possible_actions(game_board):
+            if game_board.perform_next_move(action):
+                actions.append(action)
+                break
+        else:
+            # The side to move has nothing left to do
+            game_board.declare_winner(3 - game_board.current_player)
+
+    # Adjudicate games that went on for too long as draws
+    winner = game_board.winner if game_board.game_over else 0
+    return winner, actions, game_board.goats_captured_count
+
+
+def play_pair(task: Tuple) -> Dict:
+    """Play an opening twice with the colours swapped, for the first engine"""
+    pair_number, opening, engines, max_actions = task
+    games = []
+    score = 0.0
+    for tiger_number in (0, 1):
+        tiger = engines[tiger_number]
+        goat = engines[1 - tiger_number]
+        winner, actions, captured = play_game(
+            opening, tiger, goat, tiger_number, max_actions
+        )
+        # Score of the first engine: it is the tiger in the first game
+        first_engine_winner = 2 if tiger_number == 0 else 1
+        if winner == 0:
+            score += 0.5
+        elif winner == first_engine_winner:
+            score += 1.0
+        games.append({"winner": winner, "actions": actions, "captured": captured})
+    return {"pair": pair_number, "score": score, "games": games}
+
+
+def score_to_elo(score: float) -> float:
+    """Elo difference of an expected score"""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return 400.0 * math.log10(score / (1.0 - score))
+
+
+def elo_to_score(elo: float) -> float:
+    """Expected score of an Elo difference"""
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+# Smallest variance of the pair scores used by the SPRT, a larger variance
+# only makes the test take more games
+MIN_PAIR_VARIANCE = 0.01
+
+
+class MatchStats:
+    """
+    Results of a match from the first engine's point of view. Pairs are
+    counted by their score (0, 0.5, ..., 2) as they are not independent games.
+    """
+
+    def __init__(self):
+        self.pair_scores = [0] * 5
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+
+    def add_pair(self, pair: Dict, first_engine_tiger: Tuple[bool, bool]) -> None:
+        self.pair_scores[int(pair["score"] * 2)] += 1
+        for game, is_tiger in zip(pair["games"], first_engine_tiger):
+            if game["winner"] == 0:
+                self.draws += 1
+            elif (game["winner"] == 2) == is_tiger:
+                self.wins += 1
+            else:
+                self.losses += 1
+
+    @property
+    def pairs(self) -> int:
+        return sum(self.pair_scores)
+
+    def score_and_variance(self) -> Tuple[float, float]:
+        """Mean score per game and the variance of the per-pair mean score"""
+        pairs = self.pairs
+        if not pairs:
+            return 0.5, 0.0
+        mean = sum(i / 4 * count for i, count in enumerate(self.pair_scores)) / pairs
+        mean_square = (
+            sum((i / 4) ** 2 * count for i, count in enumerate(self.pair_scores))
+            / pairs
+        )
+        return mean, max(mean_square - mean * mean, 0.0)
+
+    def elo(self) -> Tuple[float, float, float]:
+        """Elo difference with the bounds of its 95% confidence interval"""
+        score, variance = self.score_and_variance()
+        error = 1.96 * math.sqrt(variance / max(self.pairs, 1))
+        return (
+            score_to_elo(score),
+            score_to_elo(score - error),
+            score_to_elo(score + error),
+        )
+
+    def llr(self, elo0: float, elo1: float) -> float:
+        """
+        Log-likelihood ratio of H1 (elo1) against H0 (elo0), with the normal
+        approximation of the pair scores
+        """
+        score, variance = self.score_and_variance()
+        if not self.pairs:
+            return 0.0
+        # Runs of only draws or only wins have no spread, the floor lets
+        # them still reach a bound
+        variance = max(variance, MIN_PAIR_VARIANCE)
+        score0 = elo_to_score(elo0)
+        score1 = elo_to_score(elo1)
+        return (
+            (score1 - score0)
+            * (2 * score - score0 - score1)
+            / (2 * variance / self.pairs)
+        )
+
+
+def sprt_bounds(alpha: float, beta: float) -> Tuple[float, float]:
+    """Log-likelihood ratio bounds accepting H0 and H1"""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def run_match(
+    engines: Tuple[EngineConfig, EngineConfig],
+    openings: List[List[int]],
+    games: int,
+    processes: Optional[int] = None,
+    max_actions: int = 400,
+    sprt: Optional[Tuple[float, float]] = None,
+    alpha: float = 0.05,
+    beta: float = 0.05,
+    record_path: Optional[str] = None,
+) -> MatchStats:
+    """Play a match of up to games games, returns its statistics"""
+    stats = MatchStats()
+    if sprt is not None:
+        lower_bound, upper_bound = sprt_bounds(alpha, beta)
+
+    def tasks() -> Iterator[Tuple]:
+        for pair_number in range(games // 2):
+            opening = openings[pair_number % len(openings)]
+            yield pair_number, opening, engines, max_actions
+
+    record_writer = None
+    if record_path:
+        from game_records import GameRecordWriter
+
+        record_writer = GameRecordWriter(record_path)
+
+    start_time = time.time()
+    try:
+        with mp.Pool(processes or os.cpu_count(), initializer=_init_worker) as pool:
+            for pair in pool.imap_unordered(play_pair, tasks()):
+                stats.add_pair(pair, (True, False))
+                if record_writer is not None:
+                    for game in pair["games"]:
+                        # Adjudicated games are recorded as unfinished
+                        winner = game["winner"]
+                        if len(game["actions"]) >= max_actions and winner == 0:
+                            winner = 255
+                        record_writer.write_game(
+                            game["actions"], winner, game["captured"]
+                        )
+
+                elo, elo_low, elo_high = stats.elo()
+                progress = (
+                    f"Games: {stats.pairs * 2}  "
+                    f"+{stats.wins} -{stats.losses} ={stats.draws}  "
+                    f"Elo: {elo:.1f} [{elo_low:.1f}, {elo_high:.1f}]"
+                )
+                if sprt is not None:
+                    llr = stats.llr(*sprt)
+                    progress += (
+                        f"  LLR: {llr:.2f} [{lower_bound:.2f}, {upper_bound:.2f}]"
+                    )
+                print(progress, flush=True)
+
+                if sprt is not None and not lower_bound < llr < upper_bound:
+                    accepted = "H1" if llr >= upper_bound else "H0"
+                    print(f"SPRT accepts {accepted} after {stats.pairs * 2} games")
+                    break
+            # Leaving the with block terminates the pairs still being played
+    finally:
+        if record_writer is not None:
+            record_writer.close()
+
+    print(f"Match played in {time.time() - start_time:.1f} seconds")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a match between two engines")
+    parser.add_argument("engine", help="Engine config JSON file, or default")
+    parser.add_argument("opponent", help="Engine config JSON file, or default")
+    parser.add_argument("--games", type=int, default=100, help="Maximum games")
+    parser.add_argument("--openings", help="File of openings, actions per line")
+    parser.add_argument(
+        "--opening-moves", type=int, default=4, help="Moves of generated openings"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, help="Games played in parallel")
+    parser.add_argument(
+        "--max-actions",
+        type=int,
+        default=400,
+        help="Actions after which a game is adjudicated as a draw",
+    )
+    parser.add_argument(
+        "--sprt",
+        type=float,
+        nargs=2,
+        metavar=("ELO0", "ELO1"),
+        help="Stop once the Elo difference is shown to be ELO0 or ELO1",
+    )
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--record", help="Game record file to append the games to")
+    arguments = parser.parse_args()
+
+    engines = (
+        load_engine_config(arguments.engine),
+        load_engine_config(arguments.opponent),
+    )
+    if arguments.openings:
+        openings = read_openings(arguments.openings)
+    else:
+        openings = random_openings(
+            max(arguments.games // 2, 1), arguments.opening_moves, arguments.seed
+        )
+    print(f"{engines[0].name} vs {engines[1].name}, {len(openings)} openings")
+
+    stats = run_match(
+        engines,
+        openings,
+        arguments.games,
+        arguments.processes,
+        arguments.max_actions,
+        tuple(arguments.sprt) if arguments.sprt else None,
+        arguments.alpha,
+        arguments.beta,
+        arguments.record,
+    )
+
+    score, _ = stats.score_and_variance()
+    elo, elo_low, elo_high = stats.elo()
+    print(
+        f"Score of {engines[0].name} vs {engines[1].name}: "
+        f"+{stats.wins} -{stats.losses} ={stats.draws} ({score:.3f})"
+    )
+    print(f"Elo difference: {elo:.1f} (95% interval {elo_low:.1f} to {elo_high:.1f})")
+    print(f"Pair scores 0 to 2: {stats.pair_scores}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Offline tuning of the evaluation weights used by Board.get_value
+
+Positions are read from a file of fixed-width text records, one per line:
+
+    <23 board digits><2 digit goats captured><result>
+
+where the board digits are 0 (empty), 1 (goat) or 2 (tiger) and the result
+is the outcome of the game the position was taken from: 2 (tigers won),
+1 (goats won) or 0 (draw). For example:
+
+    00201102001100021010100012
+
+The file is memory-mapped and processed in chunks with vectorised NumPy
+feature extraction. Every feature of the evaluation is a small integer, so
+a single pass reduces any number of positions to a histogram of distinct
+feature vectors with their game results. The weights are then fitted
+Texel-style on that histogram: the predicted tiger win probability of a
+position is sigmoid(K * score) and the mean squared error to the actual
+results is minimised.
+
+Usage:
+    python tune_evaluation.py positions.txt -o weights.json
+    python min_max_with_alpha_beta.py --weights weights.json
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from min_max_with_alpha_beta import Board, evaluation_weights
+
+RECORD_SIZE = 27  # 23 board digits + 2 captured digits + result + newline
+FEATURE_NAMES = [
+    "blocked_tigers",
+    "goats_captured",
+    "capturable_goats",
+    "all_goats_captured",
+    "all_tigers_blocked",
+]
+RESULT_SCORES = {0: 0.5, 1: 0.0, 2: 1.0}  # Tiger's point of view
+
+MAX_CAPTURED = 15
+MAX_CAPTURABLE = 12  # 3 tigers with at most 4 jumps each
+
+
+def format_position_record(game_board: Board, result: int) -> bytes:
+    """Encode a position and the result of its game as a tuning record"""
+    board_digits = "".join(map(str, game_board.board))
+    return f"{board_digits}{game_board.goats_captured_count:02d}{result}\n".encode()
+
+
+def _padded_table(table: List[List[int]], pad: int) -> np.ndarray:
+    """Turn a ragged connectivity table into a (23, 4) array padded with pad"""
+    padded = np.full((len(table), 4), pad, dtype=np.intp)
+    for i, row in enumerate(table):
+        padded[i, : len(row)] = row
+    return padded
+
+
+def _connectivity_tables() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the step, jump landing and jumped-over tables of the board.
+    Missing entries point at index 23, an extra column that is never
+    empty and never holds a goat.
+    """
+    game_board = Board()
+    steps = _padded_table(game_board.reachable_cell_indexes, 23)
+    # Only jumps with a matching goat removal index are valid, like in Board
+    jumps = [
+        row[: len(removal)]
+        for row, removal in zip(
+            game_board.tiger_jumpable_indexes,
+            game_board.goat_removal_after_tiger_jump_indexes,
+        )
+    ]
+    landings = _padded_table(jumps, 23)
+    jumped_over = _padded_table(game_board.goat_removal_after_tiger_jump_indexes, 23)
+    return steps, landings, jumped_over
+
+
+STEPS, LANDINGS, JUMPED_OVER = _connectivity_tables()
+
+
+def extract_features(boards: np.ndarray, captured: np.ndarray) -> np.ndarray:
+    """
+    Compute the evaluation features of a batch of positions.
+    boards is an (n, 23) array of cell values, captured an (n,) array.
+    Returns an (n, 5) int array with the columns of FEATURE_NAMES.
+    """
+    sentinel = np.zeros((boards.shape[0], 1), dtype=bool)
+    empty = np.concatenate([boards == 0, sentinel], axis=1)
+    goats = np.concatenate([boards == 1, sentinel], axis=1)
+    tigers = boards == 2
+
+    can_step = empty[:, STEPS].any(axis=2)
+    can_capture = empty[:, LANDINGS] & goats[:, JUMPED_OVER]
+
+    blocked_tigers = (tigers & ~can_step & ~can_capture.any(axis=2)).sum(axis=1)
+    capturable_goats = (tigers[:, :, None] & can_capture).sum(axis=(1, 2))
+
+    features = np.empty((boards.shape[0], len(FEATURE_NAMES)), dtype=np.int64)
+    features[:, 0] = blocked_tigers
+    features[:, 1] = captured
+    features[:, 2] = capturable_goats
+    features[:, 3] = captured == MAX_CAPTURED
+    features[:, 4] = blocked_tigers == 3
+    return features
+
+
+def build_feature_histogram(
+    positions_path: str, chunk_size: int = 1_000_000
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Stream a positions file and count the results per distinct feature vector.
+    Returns (features, games, tiger_points, squared_points): the distinct
+    feature vectors, how many positions had each, and the sum and the sum of
+    squares of the tiger scores of their results.
+    """
+    records = np.memmap(positions_path, dtype=np.uint8, mode="r")
+    if records.size % RECORD_SIZE:
+        raise ValueError(
+            f"{positions_path} is not made of {RECORD_SIZE}-byte position records"
+        )
+    records = records.reshape(-1, RECORD_SIZE)
+
+    # Index of (blocked, captured, capturable, result); the flags follow from these
+    shape = (4, MAX_CAPTURED + 1, MAX_CAPTURABLE + 1, 3)
+    counts = np.zeros(int(np.prod(shape)), dtype=np.int64)
+
+    for start in range(0, records.shape[0], chunk_size):
+        chunk = np.asarray(records[start : start + chunk_size]) - ord("0")
+        boards = chunk[:, :23]
+        captured = chunk[:, 23].astype(np.int64) * 10 + chunk[:, 24]
+        results = chunk[:, 25].astype(np.int64)
+
+        features = extract_features(boards, captured)
+        index = np.ravel_multi_index(
+            (features[:, 0], features[:, 1], features[:, 2], results), shape
+        )
+        counts += np.bincount(index, minlength=counts.size)
+
+    counts = counts.reshape(shape)
+    result_points = np.array([RESULT_SCORES[result] for result in range(3)])
+    games = counts.sum(axis=3)
+    tiger_points = (counts * result_points).sum(axis=3)
+    squared_points = (counts * result_points**2).sum(axis=3)
+
+    blocked, captured, capturable = np.nonzero(games)
+    features = np.stack(
+        [
+            blocked,
+            captured,
+            capturable,
+            captured == MAX_CAPTURED,
+            blocked == 3,
+        ],
+        axis=1,
+    ).astype(np.float64)
+    bucket = (blocked, captured, capturable)
+    return features, games[bucket], tiger_points[bucket], squared_points[bucket]
+
+
+def _texel_error(
+    weights: np.ndarray,
+    scale: float,
+    features: np.ndarray,
+    games: np.ndarray,
+    tiger_points: np.ndarray,
+    squared_points: np.ndarray,
+) -> float:
+    """Mean squared error between predicted and actual results"""
+    predicted = 1.0 / (1.0 + np.exp(-scale * (features @ weights)))
+    # Sum over the positions of a bucket of (result - predicted)^2
+    error = games * predicted**2 - 2 * predicted * tiger_points + squared_points
+    return float(error.sum() / games.sum())
+
+
+def fit_scale(
+    weights: np.ndarray,
+    features: np.ndarray,
+    games: np.ndarray,
+    tiger_points: np.ndarray,
+    squared_points: np.ndarray,
+) -> float:
+    """Find the sigmoid scale K that best fits the results for fixed weights"""
+    candidates = np.geomspace(1e-4, 1.0, 200)
+    errors = [
+        _texel_error(weights, scale, features, games, tiger_points, squared_points)
+        for scale in candidates
+    ]
+    return float(candidates[int(np.argmin(errors))])
+
+
+def fit_weights(
+    initial_weights: np.ndarray,
+    scale: float,
+    features: np.ndarray,
+    games: np.ndarray,
+    tiger_points: np.ndarray,
+    iterations: int = 5000,
+    learning_rate: float = 0.5,
+) -> np.ndarray:
+    """Minimise the Texel error over the weights with Adam gradient descent"""
+    weights = initial_weights.astype(np.float64).copy()
+    first_moment = np.zeros_like(weights)
+    second_moment = np.zeros_like(weights)
+    total_games = games.sum()
+
+    for step in range(1, iterations + 1):
+        predicted = 1.0 / (1.0 + np.exp(-scale * (features @ weights)))
+        # d/dw of sum(games * p^2 - 2 * p * points) / total_games
+        residual = games * predicted - tiger_points
+        gradient = (
+            features.T
+            @ (2 * residual * scale * predicted * (1 - predicted))
+            / total_games
+        )
+
+        first_moment = 0.9 * first_moment + 0.1 * gradient
+        second_moment = 0.999 * second_moment + 0.001 * gradient**2
+        corrected_first = first_moment / (1 - 0.9**step)
+        corrected_second = second_moment / (1 - 0.999**step)
+        weights -= learning_rate * corrected_first / (np.sqrt(corrected_second) + 1e-12)
+
+    return weights
+
+
+def tune(
+    positions_path: str,
+    chunk_size: int = 1_000_000,
+    iterations: int = 5000,
+) -> Dict[str, int]:
+    """Tune the evaluation weights on a positions file"""
+    start_time = time.time()
+    features, games, tiger_points, squared_points = build_feature_histogram(
+        positions_path, chunk_size
+    )
+    print(
+        f"Read {int(games.sum())} positions into {len(games)} feature buckets "
+        f"in {time.time() - start_time:.2f} seconds"
+    )
+
+    initial_weights = np.array(
+        [evaluation_weights[name] for name in FEATURE_NAMES], dtype=np.float64
+    )
+    scale = fit_scale(initial_weights, features, games, tiger_points, squared_points)
+    initial_error = _texel_error(
+        initial_weights, scale, features, games, tiger_points, squared_points
+    )
+
+    weights = fit_weights(
+        initial_weights, scale, features, games, tiger_points, iterations
+    )
+    tuned_weights = np.rint(weights).astype(int)
+    tuned_error = _texel_error(
+        tuned_weights, scale, features, games, tiger_points, squared_points
+    )
+
+    print(f"Scale K: {scale:.5f}")
+    print(f"Error: {initial_error:.6f} -> {tuned_error:.6f}")
+    return {name: int(w) for name, w in zip(FEATURE_NAMES, tuned_weights)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the evaluation weights")
+    parser.add_argument("positions", help="File of fixed-width position records")
+    parser.add_argument(
+        "-o", "--output", default="weights.json", help="Where to write the weights"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1_000_000,
+        help="Positions processed per batch, bounds the memory used",
+    )
+    parser.add_argument("--iterations", type=int, default=5000)
+    arguments = parser.parse_args()
+
+    tuned_weights = tune(
+        arguments.positions, arguments.chunk_size, arguments.iterations
+    )
+    with open(arguments.output, "w") as weights_file:
+        json.dump(tuned_weights, weights_file, indent=2)
+    print(f"Weights written to {arguments.output}: {tuned_weights}")
+
+
+if __name__ == "__main__":
+    main()